@@ -1,13 +1,13 @@
-from database import EntryNotFound
+from database import EntryNotFound, ReadOnlyError
 from database import Key
 from database import Peer, merge_peers
 from database import MailingList
-from database import Policy, PolicyViolation
+from database import Policy, PolicyViolation, PolicyReport
 from database import Release
 
 import datetime
 
-from batzenca.session import session
+from batzenca.session import session, Session, bind
 
 import warnings
 warnings.simplefilter("always", PolicyViolation)
@@ -1,6 +1,7 @@
-from base import EntryNotFound
+from base import EntryNotFound, ReadOnlyError
 from keys import Key
 from peers import Peer, merge_peers
 from mailinglists import MailingList
-from policies import Policy, PolicyViolation
+from policies import Policy, PolicyViolation, PolicyReport
 from releases import Release
+import migrations
@@ -16,3 +16,9 @@ class EntryNotFound(ValueError):
     This exception is raised if some query returned an empty result.
     """
     pass
+
+class ReadOnlyError(RuntimeError):
+    """
+    This exception is raised if a session opened read-only is asked to modify data.
+    """
+    pass
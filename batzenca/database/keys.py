@@ -6,7 +6,7 @@
 Keys represent PGP keys and are typically stored in the database.
 """
 from base import Base, EntryNotFound
-from sqlalchemy import Column, Integer, String, Date, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Date, ForeignKey
 from sqlalchemy.ext.associationproxy import association_proxy
 
 import warnings
@@ -18,7 +18,7 @@ class Key(Base):
     particularities of dealing with the GnuPG backend are hidden behind the functions of this
     class.
 
-    :param keyid: a key id as an integer or a hex string
+    :param keyid: a key id as an integer, a hex string or a fingerprint
     :param str name: a username, if ``None`` is given, then it is read from GnuPG
     :param str email: an e-mail address, if ``None`` is given, then it is read from GnuPG
     :param timestamp: the timestamp when this key was created, if ``None`` is given, then it is
@@ -32,29 +32,60 @@ class Key(Base):
 
     id        = Column(Integer, primary_key=True)            #: database id
     kid       = Column(String, nullable=False, unique=True)  #: 8 byte pgp key id of the form 0x0123456789abcdef
-    name      = Column(String)                               #: user id
-    email     = Column(String)                               #: email as stored in key
+    keyid     = Column(BigInteger, unique=True, index=True)  #: 8 byte pgp key id as a signed 64-bit integer
+    fpr       = Column(String, index=True)                   #: fingerprint as an upper case hex string
+    name      = Column(String, index=True)                   #: user id
+    email     = Column(String, index=True)                   #: email as stored in key
     timestamp = Column(Date)                                 #: date it was added to the database
-    peer_id   = Column(Integer, ForeignKey("peers.id"))
+    expiry_date = Column(Date, index=True)                   #: cached :attr:`expires`, ``None`` if the key does not expire
+    peer_id   = Column(Integer, ForeignKey("peers.id"), index=True)
 
     releases    = association_proxy('release_associations', 'release')  #: a list of releases this key is in
 
+    @staticmethod
+    def keyid_to_int(keyid):
+        """Convert keyid to the last 64 bits as a signed integer, which is how key ids are stored in
+        the :attr:`batzenca.database.keys.Key.keyid` column.
+
+        :param keyid: a key id as an integer, a hex string or a fingerprint; a fingerprint may be
+            split into groups by spaces.
+
+        """
+        if isinstance(keyid, basestring):
+            keyid = keyid.replace(" ", "")
+            if keyid[:2] in ("0x", "0X"):
+                keyid = keyid[2:]
+            keyid = int(keyid[-16:], 16)
+        keyid = keyid % (1<<64)
+        if keyid >= (1<<63):
+            keyid -= (1<<64)
+        return keyid
+
     @staticmethod
     def canonical_keyid(keyid):
         """Convert keyid to canonical representation as a hex string of the last
         64 bits.
 
-        :param keyid: a key id as an integer or a hex string.
+        :param keyid: a key id as an integer, a hex string or a fingerprint.
 
         """
-        try:
-            keyid = "0x%016x"%keyid
-        except TypeError:
-            pass
-        return "0x%016x"%(int(keyid, 16) % (1<<64))
+        return "0x%016x"%(Key.keyid_to_int(keyid) % (1<<64))
+
+    @staticmethod
+    def _fingerprint(keyid):
+        """Return ``keyid`` as an upper case hex string if it is a fingerprint, ``None`` otherwise."""
+        if not isinstance(keyid, basestring):
+            return None
+        keyid = keyid.replace(" ", "")
+        if keyid[:2] in ("0x", "0X"):
+            keyid = keyid[2:]
+        if len(keyid) <= 16:
+            return None
+        return keyid.upper()
 
     def __init__(self, keyid, name=None, email=None, timestamp=None):
-        self.kid = Key.canonical_keyid(keyid)
+        self.keyid = Key.keyid_to_int(keyid)
+        self.kid = Key.canonical_keyid(self.keyid)
 
         from batzenca.session import session
 
@@ -75,9 +106,11 @@ class Key(Base):
         self.name = uid.name
         self.email = str(uid.email)
         self.timestamp = session.gnupg.key_timestamp(self.kid)
+        self.fpr = str(session.gnupg.key_fingerprint(self.kid)).upper()
+        self.expiry_date = session.gnupg.key_expires(self.kid) or None
 
         try:
-            Key.from_keyid(self.kid)
+            Key.from_keyid(self.keyid)
             raise ValueError("Key with keyid '%s' already found in database."%self.kid)
         except EntryNotFound:
             pass
@@ -90,24 +123,28 @@ class Key(Base):
         is found this is considered an inconsistent state of the database and a
         :class:`RuntimeError` exception is raised.
 
-        :param keyid: key id as integer or a hex string
+        :param keyid: key id as integer, a hex string or a fingerprint; if a fingerprint is given
+            a key with the same 64-bit key id but a different fingerprint is not returned
 
         .. note::
 
            The returned object was aquired from the master session and lives there.
 
         """
-        keyid = Key.canonical_keyid(keyid)
+        fpr = Key._fingerprint(keyid)
+        keyid = Key.keyid_to_int(keyid)
 
         from batzenca.session import session
-        res = session.db_session.query(cls).filter(cls.kid == keyid)
+        res = session.db_session.query(cls).filter(cls.keyid == keyid).all()
 
-        if res.count() == 0:
-            raise EntryNotFound("No key with key id '%s' in database."%keyid)
-        else:
-            if res.count() > 1:
-                raise RuntimeError("More than one key with key id '%s' in database."%keyid)
-            return res.first()
+        if len(res) == 0:
+            raise EntryNotFound("No key with key id '%s' in database."%Key.canonical_keyid(keyid))
+        if len(res) > 1:
+            raise RuntimeError("More than one key with key id '%s' in database."%Key.canonical_keyid(keyid))
+        key = res[0]
+        if fpr is not None and key.fpr is not None and key.fpr != fpr:
+            raise EntryNotFound("No key with fingerprint '%s' in database, key id '%s' belongs to '%s'."%(fpr, key.kid, key.fpr))
+        return key
 
     @classmethod
     def from_name(cls, name, all=False):
@@ -205,11 +242,11 @@ class Key(Base):
             else:
                 ret = []
                 for fpr in res.keys():
-                    keyid = Key.canonical_keyid(int("0x"+fpr[-16:], 16))
                     try:
-                        key = Key.from_keyid(keyid)
+                        key = Key.from_keyid(fpr)
+                        key.refresh()
                     except EntryNotFound:
-                        key = Key(keyid)
+                        key = Key(fpr)
                     ret.append(key)
                 ret = tuple(ret)
             if all:
@@ -245,11 +282,11 @@ class Key(Base):
         else:
             ret = []
             for fpr in res.keys():
-                keyid = Key.canonical_keyid(int("0x"+fpr[-16:], 16))
                 try:
-                    key = Key.from_keyid(keyid)
+                    key = Key.from_keyid(fpr)
+                    key.refresh()
                 except EntryNotFound:
-                    key = Key(keyid)
+                    key = Key(fpr)
                 ret.append(key)
             ret = tuple(ret)
         if all:
@@ -288,10 +325,47 @@ class Key(Base):
 
     @property
     def expires(self):
-        """Expirey date."""
+        """Expirey date as reported by GnuPG, see also :attr:`expiry_date`."""
         from batzenca.session import session
         return session.gnupg.key_expires(self.kid)
 
+    def refresh(self):
+        """Update the cached :attr:`expiry_date` from GnuPG.
+
+        This is done automatically when a key is re-imported by
+        :func:`batzenca.database.keys.Key.from_filename` or
+        :func:`batzenca.database.keys.Key.from_str`, added to a release by
+        :func:`batzenca.database.releases.Release.add_key` and for all active keys of a release by
+        :func:`batzenca.database.releases.Release.prepare`. Keys modified directly through
+        ``session.gnupg`` have to be refreshed explicitly, see
+        :func:`batzenca.database.keys.Key.refresh_all`.
+        """
+        from batzenca.session import session
+        self.expiry_date = session.gnupg.key_expires(self.kid) or None
+
+    @classmethod
+    def refresh_all(cls, keys=None):
+        """Update the cached :attr:`expiry_date` of all keys in the database from GnuPG.
+
+        All keys are read from GnuPG in one batch, keys which are not in the GnuPG keyring are left
+        unchanged. This is useful after the keyring was modified outside of this library.
+
+        :param iterable keys: the keys to refresh, if ``None`` all keys in the database
+
+        :return: the keys whose expiry date changed
+        """
+        from batzenca.session import session
+        if keys is None:
+            keys = session.db_session.query(cls).all()
+        keys = list(keys)
+        info = session.gnupg.keys_info([key.kid for key in keys], ignore_missing=True)
+        changed = []
+        for key in keys:
+            if key.kid in info and key.expiry_date != (info[key.kid].expires or None):
+                key.expiry_date = info[key.kid].expires or None
+                changed.append(key)
+        return tuple(changed)
+
     @property
     def fingerprint(self):
         """This key's fingerprint as a string in groups of four."""
@@ -304,7 +378,18 @@ class Key(Base):
         return self.timestamp < other.timestamp
 
     def __hash__(self):
-        return int(self.kid, 16)
+        return hash(self.keyid)
+
+    def __eq__(self, other):
+        """Two keys are equal if they have the same key id."""
+        if not isinstance(other, Key):
+            return NotImplemented
+        return self.keyid == other.keyid
+
+    def __ne__(self, other):
+        if not isinstance(other, Key):
+            return NotImplemented
+        return self.keyid != other.keyid
 
     @property
     def algorithms(self):
@@ -364,17 +449,17 @@ class Key(Base):
 
         """
         from batzenca.session import session
-        keyids = tuple(Key.canonical_keyid(keyid) for
+        keyids = tuple(Key.keyid_to_int(keyid) for
                        keyid in session.gnupg.key_signatures(self.kid))
         sigs = []
         for keyid in keyids:
-            if int(self.kid, 16) == int(keyid, 16):
+            if self.keyid == keyid:
                 sigs.append(self)
                 continue
             try:
-                sigs.append(Key.from_keyid(int(keyid, 16)))
+                sigs.append(Key.from_keyid(keyid))
             except EntryNotFound:
-                sigs.append(keyid)
+                sigs.append(Key.canonical_keyid(keyid))
         return tuple(sigs)
 
     def clean(self, whitelist=None):
@@ -0,0 +1,119 @@
+"""
+.. module:: loading
+
+.. moduleauthor:: Martin R. Albrecht <martinralbrecht+batzenca@googlemail.com>
+
+Named eager-loading profiles for releases.
+
+All relationships between releases, key associations, keys, peers and policies are loaded lazily
+by default. Workflows which walk a release's object graph would hence issue one query per object
+they touch. A loading profile names the relationships a workflow walks, so that they can be loaded
+up front by a bounded number of queries::
+
+    >>> release.load("publish")
+    >>> with no_lazy_loads():
+    ...     peers = [assoc.key.peer for assoc in release.key_associations]
+
+The following profiles are available:
+
+``verify``
+    associations and their keys, the policy and its CA key; walked by
+    :func:`batzenca.database.releases.Release.verify`
+
+``report``
+    associations, their keys and peers, the mailing list, the policy and its CA key; walked when
+    printing or dumping a release
+
+``publish``
+    associations, their keys, peers and the peers' other keys, the mailing list, the policy and its
+    CA key; walked by :func:`batzenca.database.releases.Release.send`
+"""
+
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, selectinload
+
+PROFILES = ("verify", "report", "publish")
+
+
+class LazyLoadError(RuntimeError):
+    """
+    This exception is raised by :func:`batzenca.database.loading.no_lazy_loads` if a block issued
+    a query.
+    """
+    pass
+
+
+def options(profile):
+    """Return a tuple of query options for loading releases according to ``profile``.
+
+    :param str profile: the name of a loading profile, see :mod:`batzenca.database.loading`
+
+    """
+    from releases import Release, ReleaseKeyAssociation
+    from keys import Key
+    from peers import Peer
+    from policies import Policy
+
+    keys = selectinload(Release.key_associations).joinedload(ReleaseKeyAssociation.key)
+    ca   = joinedload(Release.policy).joinedload(Policy.ca)
+
+    if profile == "verify":
+        return (keys, ca)
+    elif profile == "report":
+        return (keys.joinedload(Key.peer), joinedload(Release.mailinglist), ca)
+    elif profile == "publish":
+        return (keys.joinedload(Key.peer).selectinload(Peer.keys), joinedload(Release.mailinglist), ca)
+    else:
+        raise ValueError("Loading profile '%s' unknown. Supported profiles are '%s'"%(profile, ", ".join(PROFILES)))
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Record all queries issued by the calling thread inside a ``with`` block.
+
+    :param engine: the SQLAlchemy engine to watch, if ``None`` the master session's engine is used
+
+    :return: a list which receives the SQL string of each ``SELECT`` statement issued in the block
+
+    .. note::
+
+       Queries issued by other threads on the same engine, e.g. through their own database
+       sessions, are not recorded.
+
+    """
+    if engine is None:
+        from batzenca.session import session
+        engine = session.db_engine
+
+    statements = []
+    caller = threading.current_thread()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if threading.current_thread() is caller and statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+@contextmanager
+def no_lazy_loads(engine=None):
+    """Raise a :class:`batzenca.database.loading.LazyLoadError` if a ``with`` block issued any
+    query.
+
+    This is meant to assert that a loading profile covers all relationships a block walks. Every
+    ``SELECT`` statement the calling thread issues inside the block is considered a lazy load.
+
+    :param engine: the SQLAlchemy engine to watch, if ``None`` the master session's engine is used
+
+    """
+    with count_queries(engine) as statements:
+        yield
+    if statements:
+        raise LazyLoadError("%d queries were issued, the first one was:\n%s"%(len(statements), statements[0]))
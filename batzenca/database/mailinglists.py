@@ -117,6 +117,9 @@ class MailingList(Base):
     policy      = relationship("Policy")
     active      = Column(Boolean)
 
+    current_release_id = Column(Integer, ForeignKey('releases.id', use_alter=True, name='fk_mailinglists_current_release_id'))
+    _current_release   = relationship("Release", foreign_keys=[current_release_id], post_update=True)
+
     def __init__(self, name, email, policy=None, description='', new_member_msg='', key_update_msg='', key_expiry_warning_msg='', dead_man_switch_msg=''):
         self.name = name
         self.email = email
@@ -156,10 +159,9 @@ class MailingList(Base):
         """
         Return the current release.
         """
-        try:
-            return self.releases[-1]
-        except IndexError:
+        if self._current_release is None:
             raise IndexError("The mailing list '%s' has no release yet."%self)
+        return self._current_release
 
     def new_release(self, date=None, inherit=True, deactivate_invalid=True, delete_old_inactive_keys=5):
         """Create a new release for this mailing list.
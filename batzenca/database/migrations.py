@@ -0,0 +1,241 @@
+"""
+.. module:: migrations
+
+.. moduleauthor:: Martin R. Albrecht <martinralbrecht+batzenca@googlemail.com>
+
+Schema migrations for existing databases.
+
+A fresh database is created from the current models and stamped with the most recent schema
+version. A database created by an earlier version of this library is brought up to date by applying
+all pending migration steps in order. Each step runs in its own transaction which also records the
+new schema version in the ``schemaversion`` table.
+"""
+
+from contextlib import contextmanager
+
+import sqlalchemy
+from sqlalchemy import Table, Column, Integer, event
+
+from base import Base
+
+schema_version = Table('schemaversion', Base.metadata,
+                       Column('version', Integer, nullable=False))
+
+#: ordered list of ``(version, description, step)`` triples
+MIGRATIONS = []
+
+
+def migration(description):
+    """Register the decorated function as the next migration step.
+
+    A step is called with an open connection inside a transaction and the
+    :class:`batzenca.session.Session` the migration is run for (which may be ``None``). Steps should
+    not fail if the change they make is already present, e.g. because the database was created
+    from the current models.
+
+    :param str description: a short human readable description of this step
+    """
+    def register(step):
+        MIGRATIONS.append((len(MIGRATIONS)+1, description, step))
+        return step
+    return register
+
+
+def head():
+    """Return the most recent schema version known to this library."""
+    return len(MIGRATIONS)
+
+
+def current_version(connection):
+    """Return the schema version recorded in the database or ``0`` if none is recorded.
+
+    :param connection: an SQLAlchemy engine or connection
+    """
+    if not _has_table(connection, schema_version.name):
+        return 0
+    row = connection.execute(sqlalchemy.select([schema_version.c.version])).fetchone()
+    if row is None:
+        return 0
+    return row[0]
+
+
+def _has_table(connection, table_name):
+    return table_name in sqlalchemy.inspect(connection).get_table_names()
+
+
+def _set_version(connection, version):
+    connection.execute(schema_version.delete())
+    connection.execute(schema_version.insert().values(version=version))
+
+
+def _create_index(connection, table_name, index_name):
+    """Create the index ``index_name`` declared on ``table_name`` by the models unless it exists."""
+    existing = set(index['name'] for index in sqlalchemy.inspect(connection).get_indexes(table_name))
+    if index_name in existing:
+        return
+    for index in Base.metadata.tables[table_name].indexes:
+        if index.name == index_name:
+            index.create(connection)
+            return
+    raise ValueError("No index '%s' is declared on table '%s'."%(index_name, table_name))
+
+
+def _add_column(connection, table_name, column_name):
+    """Add the column ``column_name`` declared on ``table_name`` by the models unless it exists."""
+    existing = set(column['name'] for column in sqlalchemy.inspect(connection).get_columns(table_name))
+    if column_name in existing:
+        return
+    column = Base.metadata.tables[table_name].c[column_name]
+    ddl = "ALTER TABLE %s ADD COLUMN %s %s"%(table_name, column_name, column.type.compile(dialect=connection.dialect))
+    for foreign_key in column.foreign_keys:
+        ddl += " REFERENCES %s (%s)"%(foreign_key.column.table.name, foreign_key.column.name)
+    connection.execute(ddl)
+
+
+def _emit_begin(connection):
+    connection.execute("BEGIN")
+
+
+@contextmanager
+def _transaction(engine):
+    """Return a connection to ``engine`` inside a transaction which is committed when the ``with``
+    block is left and rolled back if it raises.
+
+    The Python 2 SQLite driver commits implicitly before DDL statements, so for SQLite its own
+    transaction handling is switched off for the connection and ``BEGIN`` is emitted explicitly
+    instead, as recommended by the SQLAlchemy documentation.
+    """
+    connection = engine.connect()
+    try:
+        if connection.dialect.name != "sqlite":
+            with connection.begin():
+                yield connection
+            return
+
+        dbapi_connection = connection.connection.connection
+        isolation_level, dbapi_connection.isolation_level = dbapi_connection.isolation_level, None
+        event.listen(connection, "begin", _emit_begin)
+        try:
+            with connection.begin():
+                yield connection
+        finally:
+            event.remove(connection, "begin", _emit_begin)
+            dbapi_connection.isolation_level = isolation_level
+    finally:
+        connection.close()
+
+
+def upgrade(engine, session=None, snapshot=None):
+    """Create or upgrade the database behind ``engine`` to the most recent schema version.
+
+    :param engine: an SQLAlchemy engine
+    :param batzenca.session.Session session: passed on to each migration step
+    :param snapshot: a callable which is called with the target version before the first pending
+        migration step is applied, e.g. to take a snapshot of the database
+
+    :return: a tuple of the schema versions which were applied
+
+    """
+    if not _has_table(engine, 'keys'):
+        with _transaction(engine) as connection:
+            Base.metadata.create_all(connection)
+            _set_version(connection, head())
+        return tuple()
+
+    version = current_version(engine)
+    if version > head():
+        raise RuntimeError("The database has schema version %d but this library only knows versions up to %d."%(version, head()))
+
+    pending = [entry for entry in MIGRATIONS if entry[0] > version]
+    if not pending:
+        return tuple()
+
+    if snapshot is not None:
+        snapshot(pending[-1][0])
+
+    schema_version.create(engine, checkfirst=True)
+    for number, description, step in pending:
+        with _transaction(engine) as connection:
+            step(connection, session)
+            _set_version(connection, number)
+
+    # pick up tables which were added to the models without a dedicated migration step
+    Base.metadata.create_all(engine)
+    return tuple(entry[0] for entry in pending)
+
+
+@migration("add secondary indexes")
+def _add_secondary_indexes(connection, session):
+    for table_name, index_name in (("keys",                   "ix_keys_email"),
+                                   ("keys",                   "ix_keys_name"),
+                                   ("keys",                   "ix_keys_peer_id"),
+                                   ("peers",                  "ix_peers_name"),
+                                   ("releases",               "ix_releases_mailinglist_id_date"),
+                                   ("releasekeyassociations", "ix_releasekeyassociations_right_id_is_active")):
+        _create_index(connection, table_name, index_name)
+
+
+@migration("link releases to their predecessors and mailing lists to their current release")
+def _add_release_chain(connection, session):
+    _add_column(connection, "releases", "previous_release_id")
+    _add_column(connection, "mailinglists", "current_release_id")
+    _create_index(connection, "releases", "ix_releases_previous_release_id")
+
+    releases     = Base.metadata.tables["releases"]
+    mailinglists = Base.metadata.tables["mailinglists"]
+
+    res = connection.execute(sqlalchemy.select([releases.c.id, releases.c.mailinglist_id]).order_by(releases.c.mailinglist_id,
+                                                                                                   releases.c.date,
+                                                                                                   releases.c.id))
+    links, current = [], {}
+    for release_id, mailinglist_id in res:
+        links.append({"_id": release_id, "_previous": current.get(mailinglist_id)})
+        current[mailinglist_id] = release_id
+
+    if links:
+        connection.execute(releases.update().where(releases.c.id == sqlalchemy.bindparam("_id")).values(previous_release_id=sqlalchemy.bindparam("_previous")), links)
+    if current:
+        connection.execute(mailinglists.update().where(mailinglists.c.id == sqlalchemy.bindparam("_id")).values(current_release_id=sqlalchemy.bindparam("_current")),
+                           [{"_id": mailinglist_id, "_current": release_id} for mailinglist_id, release_id in current.items()])
+
+
+@migration("store key ids as integers and record fingerprints")
+def _add_keyid_and_fingerprint(connection, session):
+    from keys import Key
+
+    _add_column(connection, "keys", "keyid")
+    _add_column(connection, "keys", "fpr")
+
+    keys = Base.metadata.tables["keys"]
+    rows = []
+    for id, kid in connection.execute(sqlalchemy.select([keys.c.id, keys.c.kid])):
+        fpr = None
+        if session is not None:
+            from batzenca.gnupg import KeyError as GnuPGKeyError
+            try:
+                fpr = str(session.gnupg.key_fingerprint(str(kid))).upper()
+            except GnuPGKeyError:
+                pass
+        rows.append({"_id": id, "_keyid": Key.keyid_to_int(kid), "_fpr": fpr})
+
+    if rows:
+        connection.execute(keys.update().where(keys.c.id == sqlalchemy.bindparam("_id")).values(keyid=sqlalchemy.bindparam("_keyid"),
+                                                                                               fpr=sqlalchemy.bindparam("_fpr")), rows)
+    _create_index(connection, "keys", "ix_keys_keyid")
+    _create_index(connection, "keys", "ix_keys_fpr")
+
+
+@migration("cache key expiry dates")
+def _add_expiry_date(connection, session):
+    _add_column(connection, "keys", "expiry_date")
+
+    keys = Base.metadata.tables["keys"]
+    rows = []
+    if session is not None:
+        kids = [str(kid) for (kid,) in connection.execute(sqlalchemy.select([keys.c.kid]))]
+        info = session.gnupg.keys_info(kids, ignore_missing=True)
+        rows = [{"_kid": kid, "_expiry_date": info[kid].expires or None} for kid in kids if kid in info]
+
+    if rows:
+        connection.execute(keys.update().where(keys.c.kid == sqlalchemy.bindparam("_kid")).values(expiry_date=sqlalchemy.bindparam("_expiry_date")), rows)
+    _create_index(connection, "keys", "ix_keys_expiry_date")
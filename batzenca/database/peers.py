@@ -34,7 +34,7 @@ class Peer(Base):
     __tablename__ = 'peers'
 
     id    = Column(Integer, primary_key=True)  #: database id
-    name  = Column(String, nullable=False)     #: the peer's name
+    name  = Column(String, nullable=False, index=True)  #: the peer's name
     keys  = relationship('Key', backref=backref('peer'), order_by=Key.timestamp)  #: a list of all keys associated with this peer
 
     data0 = Column(String)  #: free form data associated with this peer
@@ -99,7 +99,7 @@ class Peer(Base):
 
         """
         from batzenca.session import session
-        res = session.db_session.query(cls).join(Key).filter(Key.kid == key.kid)
+        res = session.db_session.query(cls).join(Key).filter(Key.keyid == key.keyid)
 
         if res.count() == 0:
             raise EntryNotFound("No peer matching key '%s' in database."%key)
@@ -12,6 +12,7 @@ from sqlalchemy.orm import relationship, backref
 
 import datetime
 import warnings
+from collections import namedtuple
 
 from base import Base, EntryNotFound
 from keys import Key
@@ -39,6 +40,122 @@ class PolicyViolation(Warning):
     def __init__(self, msg):
         Warning.__init__(self, msg.encode('utf8'))
 
+PolicyResult = namedtuple("PolicyResult", ("kid", "keyid", "rule", "passed", "exception", "message"))
+
+
+class PolicyReport(object):
+    """The outcome of checking keys against a :class:`batzenca.database.policies.Policy`, as returned
+    by :func:`batzenca.database.policies.Policy.evaluate`.
+
+    A report holds one :class:`batzenca.database.policies.PolicyResult` per key and rule. A result
+    whose key has a policy exception does not count as a failure but is kept, with ``exception``
+    set, so that it can still be inspected. Reports only hold plain values, hence they may be pickled
+    and passed between processes, and :func:`batzenca.database.policies.PolicyReport.as_dict`
+    returns something which may be serialised as JSON or YAML::
+
+        >>> report = release.verify(warn=False)
+        >>> for result in report.failures(rule="expiration"):
+        ...     print result.kid, result.message
+
+    :param int policy_id: the database id of the policy
+    :param str policy_name: the name of the policy
+    :param iterable results: :class:`batzenca.database.policies.PolicyResult` tuples
+
+    """
+    def __init__(self, policy_id, policy_name, results=()):
+        self.policy_id = policy_id
+        self.policy_name = policy_name
+        self.results = tuple(results)
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return "<PolicyReport: %s, %d keys, %d failures>"%(self.policy_name, len(self.kids), len(self.failures()))
+
+    @property
+    def kids(self):
+        """The key ids of all keys in this report."""
+        kids = []
+        for result in self.results:
+            if result.kid not in kids:
+                kids.append(result.kid)
+        return tuple(kids)
+
+    @property
+    def passed(self):
+        """``True`` if every key in this report passed every rule or has a policy exception."""
+        return not self.failures()
+
+    def filter(self, key=None, rule=None, passed=None, exception=None):
+        """Return the results matching all given criteria as a tuple.
+
+        :param key: a :class:`batzenca.database.keys.Key`, a key id as used in
+            :attr:`batzenca.database.keys.Key.kid` or an integer as used in
+            :attr:`batzenca.database.keys.Key.keyid`
+        :param str rule: one of :attr:`batzenca.database.policies.Policy.rules`
+        :param boolean passed: select results which passed the rule or not
+        :param boolean exception: select results of keys with or without a policy exception
+        """
+        if key is not None and not isinstance(key, (int, long, basestring)):
+            key = key.kid
+        return tuple(result for result in self.results
+                     if (key is None or key in (result.kid, result.keyid))
+                     and (rule is None or result.rule == rule)
+                     and (passed is None or result.passed == passed)
+                     and (exception is None or result.exception == exception))
+
+    def failures(self, key=None, rule=None):
+        """Return the results which failed and are not covered by a policy exception.
+
+        :param key: restrict to this key, see :func:`batzenca.database.policies.PolicyReport.filter`
+        :param str rule: restrict to this rule
+        """
+        return self.filter(key=key, rule=rule, passed=False, exception=False)
+
+    def failed_keys(self):
+        """Return the key ids of all keys with at least one failure."""
+        kids = []
+        for result in self.failures():
+            if result.kid not in kids:
+                kids.append(result.kid)
+        return tuple(kids)
+
+    def warn(self, exceptions=False):
+        """Issue a :class:`batzenca.database.policies.PolicyViolation` warning for every failure.
+
+        :param boolean exceptions: if ``True`` warnings are also issued for keys with a policy
+            exception.
+        """
+        for result in self.filter(passed=False, exception=None if exceptions else False):
+            warnings.warn(result.message, PolicyViolation)
+
+    def merge(self, *others):
+        """Return a new report with the results of this report and ``others``.
+
+        :param others: reports for the same policy, e.g. for disjoint sets of keys
+        """
+        results = list(self.results)
+        for other in others:
+            if other.policy_id != self.policy_id:
+                raise ValueError("Cannot merge reports for policies '%s' and '%s'."%(self.policy_name, other.policy_name))
+            results.extend(other.results)
+        return PolicyReport(self.policy_id, self.policy_name, results)
+
+    def as_dict(self):
+        """Return this report as a dictionary mapping key ids to dictionaries mapping rules to
+        dictionaries with the entries ``passed``, ``exception`` and ``message``."""
+        d = {}
+        for result in self.results:
+            d.setdefault(result.kid, {})[result.rule] = {"passed": result.passed,
+                                                          "exception": result.exception,
+                                                          "message": result.message}
+        return {"policy": self.policy_name, "keys": d}
+
+
 class Policy(Base):
     """Releases are checked against policies.
 
@@ -99,7 +216,7 @@ class Policy(Base):
 
         """
         from batzenca.session import session
-        res = session.db_session.query(cls).join(Key).filter(Key.kid == key.kid)
+        res = session.db_session.query(cls).join(Key).filter(Key.keyid == key.keyid)
 
         if res.count() == 0:
             raise EntryNotFound("No peer matching key '%s' in database."%key)
@@ -195,6 +312,73 @@ class Policy(Base):
             return False
         return True
 
+    #: the rules checked by :func:`batzenca.database.policies.Policy.evaluate`
+    rules = ("length", "algorithms", "expiration", "ca_signature")
+
+    def evaluate(self, keys, exceptions=(), rules=None, date=None):
+        """Check all ``keys`` against this policy and return a
+        :class:`batzenca.database.policies.PolicyReport`.
+
+        The attributes of all keys are fetched from GnuPG in one batch, see
+        :func:`batzenca.gnupg.GnuPG.keys_info`, and every rule is then evaluated over the whole
+        set. No warnings are issued, call :func:`batzenca.database.policies.PolicyReport.warn` for
+        that.
+
+        :param iterable keys: the :class:`batzenca.database.keys.Key` objects to check
+        :param iterable exceptions: keys which have a policy exception, failures of these keys are
+            recorded but do not count as failures of the report
+        :param iterable rules: the rules to check, by default all of
+            :attr:`batzenca.database.policies.Policy.rules`
+        :param datetime.date date: the date against which the key lifespan is checked, by default
+            today
+
+        """
+        from batzenca.session import session
+
+        keys = list(keys)
+        rules = self.rules if rules is None else tuple(rules)
+        for rule in rules:
+            if rule not in self.rules:
+                raise ValueError("Rule '%s' is unknown. Supported rules are '%s'"%(rule, ", ".join(self.rules)))
+        exceptions = set(key.kid for key in exceptions)
+        if date is None:
+            date = datetime.date.today()
+
+        kids = [key.kid for key in keys]
+        if "ca_signature" in rules:
+            kids.append(self.ca.kid)
+        info = session.gnupg.keys_info(kids)
+
+        algorithms = self.algorithms
+        max_expiry = date + datetime.timedelta(days=self.key_lifespan)
+        if "ca_signature" in rules:
+            ca_sign_keys = info[self.ca.kid].sign_keys
+
+        results = []
+        for key in keys:
+            key_info = info[key.kid]
+            for rule in rules:
+                message = None
+                if rule == "length":
+                    if key_info.length < self.key_len:
+                        message = u"Key '%s' has key length %d but at least %d is required by '%s'."%(unicode(key), key_info.length, self.key_len, unicode(self))
+                elif rule == "algorithms":
+                    diff = set(key_info.algorithms).difference(algorithms)
+                    if algorithms and diff:
+                        diff_str = ",".join(session.gnupg.alg_to_str[e] for e in diff)
+                        message = u"Key '%s' uses algorithm(s) '%s' which is/are not in '%s' as mandated by '%s'."%(unicode(key), diff_str, self.algorithms_str, unicode(self))
+                elif rule == "expiration":
+                    if not key_info.expires:
+                        if self.key_lifespan > 0:
+                            message = u"Key '%s'does not expire but expiry of %d days is mandated by '%s'."%(unicode(key), self.key_lifespan, unicode(self))
+                    elif max_expiry < key_info.expires:
+                        message = u"Key '%s' expires on %s but max allowed expiration date is %s."%(unicode(key), key_info.expires, max_expiry)
+                elif rule == "ca_signature":
+                    if not ca_sign_keys.intersection(key_info.signatures):
+                        message = u"No UID of Key '%s' has a valid signature of the CA key '%s'"%(unicode(key), unicode(self.ca))
+                results.append(PolicyResult(key.kid, key.keyid, rule, message is None, key.kid in exceptions, message))
+        return PolicyReport(self.id, self.name, results)
+
     def check(self, key, check_ca_signature=True):
         """Check if the provided key is valid according to this policy.
 
@@ -206,14 +390,17 @@ class Policy(Base):
             signed by the CA's key. This might be useful when the CA decides whether to sign this
             key depending on whether it is valid otherwise.
 
+        .. note::
+
+            This function issues a :class:`batzenca.database.policies.PolicyViolation` warning for
+            every rule ``key`` violates. Use :func:`batzenca.database.policies.Policy.evaluate` to
+            check many keys at once.
+
         """
-        ret = True
-        ret &= self.check_length(key)
-        ret &= self.check_algorithms(key)
-        ret &= self.check_expiration(key)
-        if check_ca_signature:
-            ret &= self.check_ca_signature(key)
-        return ret
+        rules = [rule for rule in self.rules if check_ca_signature or rule != "ca_signature"]
+        report = self.evaluate([key], rules=rules)
+        report.warn()
+        return report.passed
 
     def __str__(self):
         return "%s: (%d, %d, (%s))"%(self.name, self.key_len, self.key_lifespan, self.algorithms_str)
@@ -13,8 +13,8 @@ import datetime
 import warnings
 import codecs
 
-from sqlalchemy import Column, Integer, Date, Boolean, ForeignKey
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy import Column, Integer, Date, Boolean, ForeignKey, Index, event
+from sqlalchemy.orm import relationship, backref, Session as DBSession
 from sqlalchemy.ext.associationproxy import association_proxy
 
 from base import Base, EntryNotFound
@@ -33,6 +33,8 @@ class ReleaseKeyAssociation(Base):
     key              = relationship("Key", backref=backref("release_associations", cascade="all, delete-orphan"))
     release          = relationship("Release", backref=backref("key_associations", cascade="all, delete-orphan"))
 
+    __table_args__   = (Index('ix_releasekeyassociations_right_id_is_active', 'right_id', 'is_active'),)
+
     def __init__(self, key, active=True, policy_exception=False):
         self.key = key
         self.is_active = active
@@ -61,7 +63,7 @@ class Release(Base):
 
     id             = Column(Integer, primary_key=True)
     mailinglist_id = Column(Integer, ForeignKey('mailinglists.id'))
-    mailinglist    = relationship("MailingList",
+    mailinglist    = relationship("MailingList", foreign_keys=[mailinglist_id],
                                   backref=backref("releases", order_by="Release.date", cascade="all, delete-orphan"))
     date           = Column(Date)
     published      = Column(Boolean)
@@ -69,13 +71,33 @@ class Release(Base):
     policy_id      = Column(Integer, ForeignKey('policies.id'))
     policy         = relationship("Policy")
 
+    previous_release_id = Column(Integer, ForeignKey('releases.id'), index=True)
+    previous_release    = relationship("Release", remote_side=[id])  #: the release preceding this release on its mailing list
+
     keys           = association_proxy('key_associations', 'key')
 
-    def __init__(self, mailinglist, date, active_keys, inactive_keys=None, policy=None):
-        self.mailinglist = mailinglist
+    _membership_cache = None
+
+    __table_args__ = (Index('ix_releases_mailinglist_id_date', 'mailinglist_id', 'date'),)
 
+    def __init__(self, mailinglist, date, active_keys, inactive_keys=None, policy=None):
         if date is None:
             date = datetime.date.today()
+
+        # releases form a chain per mailing list ordered by (date, id), the newest release is its
+        # current release. A release older than the current release is linked in where it belongs,
+        # which only visits the releases after it.
+        successor, previous = None, mailinglist._current_release
+        while previous is not None and previous.date > date:
+            successor, previous = previous, previous.previous_release
+
+        self.mailinglist = mailinglist
+        self.previous_release = previous
+        if successor is None:
+            mailinglist._current_release = self
+        else:
+            successor.previous_release = self
+
         self.date = date
 
         if policy is not None:
@@ -131,42 +153,62 @@ class Release(Base):
           :func:`batzenca.database.releases.Release.delete_old_inactive_keys` as
           ``releasecount``.
 
+        .. note::
+
+           The key associations are copied by a single ``INSERT ... SELECT`` statement, policy
+           exceptions of active keys are carried forward.
+
         """
-        active_keys   = list(self.active_keys)
-        inactive_keys = list(self.inactive_keys)
+        from sqlalchemy import select, case, and_, literal
+        from batzenca.session import session
 
         if policy is None:
             policy = self.policy
 
         release = Release(mailinglist=self.mailinglist,
                           date=date,
-                          active_keys=active_keys,
-                          inactive_keys=inactive_keys,
+                          active_keys=[],
+                          inactive_keys=[],
                           policy=policy)
+        session.db_session.flush()
+
+        RKA = ReleaseKeyAssociation.__table__
+        policy_exception = case([(and_(RKA.c.is_active == True, RKA.c.policy_exception == True), True)], else_=False)
+        copy = select([RKA.c.left_id, literal(release.id), policy_exception, RKA.c.is_active]).where(RKA.c.right_id == self.id)
+        session.db_session.execute(RKA.insert().from_select(["left_id", "right_id", "policy_exception", "is_active"], copy))
+        release._expire_associations()
 
         if deactivate_invalid:
             release.deactivate_invalid()
         if delete_old_inactive_keys:
             release.delete_old_inactive_keys(delete_old_inactive_keys)
 
-        for key in self.active_keys:
-            if self.has_exception(key):
-                release.add_exception(key)
-
         return release
 
-    def verify(self, ignore_exceptions=False):
+    def verify(self, ignore_exceptions=False, warn=True):
         """
         Check if all active keys in this release pass the policy check.
 
+        All active keys are checked in one batch, see
+        :func:`batzenca.database.policies.Policy.evaluate`.
+
         :param boolean ignore_exceptions: keys may have a policy exception which means that they
-           pass this test even though they do violate the policy. By default active keys with an
-           existing policy exception are ignored. If ``True`` these keys are checked as well.
+           pass this test even though they do violate the policy. By default failures of active
+           keys with an existing policy exception are not counted. If ``True`` these keys are
+           treated like all other keys.
+        :param boolean warn: if ``True`` a :class:`batzenca.database.policies.PolicyViolation`
+           warning is issued for every failure.
+
+        :return: a :class:`batzenca.database.policies.PolicyReport`
 
         """
-        for assoc in self.key_associations:
-            if assoc.is_active and (ignore_exceptions or not assoc.policy_exception):
-                self.policy.check(assoc.key)
+        self.load("verify")
+        active = [assoc for assoc in self.key_associations if assoc.is_active]
+        exceptions = [] if ignore_exceptions else [assoc.key for assoc in active if assoc.policy_exception]
+        report = self.policy.evaluate([assoc.key for assoc in active], exceptions=exceptions)
+        if warn:
+            report.warn()
+        return report
 
     def __repr__(self):
         s = "<Release: %s, %s (%s), %s (%s + %s) keys>"%(self.id,
@@ -178,18 +220,16 @@ class Release(Base):
         return unicode(s).encode('utf-8')
 
     def __str__(self):
-        from batzenca.database.policies import PolicyViolation
         inact_no_sig = 0
         inact_expired = 0
-        policy = self.policy
+        self.load("report")
+        report = self.policy.evaluate(self.keys, rules=("ca_signature",))
         for key in self.keys:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore", PolicyViolation)
-                if not policy.check_ca_signature(key):
-                    inact_no_sig += 1
-                    continue
+            if report.failures(key=key):
+                inact_no_sig += 1
+                continue
 
-            if key.expires and key.expires < self.date:
+            if key.expiry_date and key.expiry_date < self.date:
                 inact_expired += 1
                 continue
 
@@ -208,7 +248,7 @@ class Release(Base):
         :param batzenca.database.releases.Release other: the release to compare
             against, if ``None`` then ``self.prev`` is chosen
 
-        :return: this function returns five tuples:
+        :return: this function returns five sets:
 
         - ``keys_in`` - keys that are active in this release but are not active in ``other``
         - ``keys_out`` - all keys that are either active or inactive in ``other`` but are not active
@@ -224,52 +264,209 @@ class Release(Base):
             if other is None:
                 return set(), set(), set(), set(), set()
 
-        keys_prev = set(other.active_keys + self.inactive_keys)
-        keys_curr = set(self.active_keys)  # keys that are in this release
+        return Release.diff_range(other, self)
+
+    @classmethod
+    def diff_range(cls, first, last):
+        """Compare the two releases ``first`` and ``last``.
 
-        # keys that used to be in but are not any more
-        keys_out = keys_prev.difference(keys_curr)
-        # keys that are new
-        keys_in  = keys_curr.difference(other.active_keys)
+        This is :func:`batzenca.database.releases.Release.diff` for ``last.diff(first)``, except
+        that ``first`` and ``last`` do not need to be consecutive releases or be on the same mailing
+        list. Each of the five returned sets is computed by one query over the key associations of
+        both releases. Keys without a peer do not contribute to the peer sets.
 
-        peers_prev = set([Peer.from_key(key) for key in keys_prev])
-        peers_curr = set([Peer.from_key(key) for key in keys_curr])
-        peers_in   = set([Peer.from_key(key) for key in keys_in])
-        peers_out  = set([Peer.from_key(key) for key in keys_out])
+        :param batzenca.database.releases.Release first: the earlier release
+        :param batzenca.database.releases.Release last: the later release
 
-        peers_joined  = peers_curr.difference(peers_prev)
-        peers_changed = peers_in.intersection(peers_out)
-        peers_left    = peers_prev.difference(peers_curr)
+        :return: a tuple ``(keys_in, keys_out, peers_joined, peers_changed, peers_left)``, see
+            :func:`batzenca.database.releases.Release.diff`
+
+        """
+        from batzenca.session import session
+        from sqlalchemy.sql import and_, or_
+
+        if first.id is None or last.id is None:
+            session.db_session.flush()
+        for release in (first, last):
+            if release.id is None:
+                raise RuntimeError("The object '%s' was not committed to the database yet, we cannot issue queries involving its id yet."%release)
+
+        query = session.db_session.query
+
+        # key ids active in first
+        first_active = query(ReleaseKeyAssociation.left_id).filter(ReleaseKeyAssociation.right_id == first.id,
+                                                                   ReleaseKeyAssociation.is_active == True).subquery()
+        # key ids active in last
+        curr = query(ReleaseKeyAssociation.left_id).filter(ReleaseKeyAssociation.right_id == last.id,
+                                                           ReleaseKeyAssociation.is_active == True).subquery()
+        # key ids active in first or inactive in last
+        prev = query(ReleaseKeyAssociation.left_id).filter(or_(and_(ReleaseKeyAssociation.right_id == first.id,
+                                                                    ReleaseKeyAssociation.is_active == True),
+                                                               and_(ReleaseKeyAssociation.right_id == last.id,
+                                                                    ReleaseKeyAssociation.is_active == False))).subquery()
+
+        def peer_ids(*conditions):
+            return query(Key.peer_id).filter(Key.peer_id != None, *conditions).subquery()
+
+        keys_in  = set(query(Key).filter(Key.id.in_(curr), ~Key.id.in_(first_active)))
+        keys_out = set(query(Key).filter(Key.id.in_(prev), ~Key.id.in_(curr)))
+
+        peers_curr = peer_ids(Key.id.in_(curr))
+        peers_prev = peer_ids(Key.id.in_(prev))
+
+        peers_joined  = set(query(Peer).filter(Peer.id.in_(peers_curr), ~Peer.id.in_(peers_prev)))
+        peers_changed = set(query(Peer).filter(Peer.id.in_(peer_ids(Key.id.in_(curr), ~Key.id.in_(first_active))),
+                                               Peer.id.in_(peer_ids(Key.id.in_(prev), ~Key.id.in_(curr)))))
+        peers_left    = set(query(Peer).filter(Peer.id.in_(peers_prev), ~Peer.id.in_(peers_curr)))
 
         return keys_in, keys_out, peers_joined, peers_changed, peers_left
 
     @property
     def peers(self):
         """All active peers in this release"""
-        return tuple(Peer.from_key(key) for key in sorted(self.active_keys, key=lambda x:
-                                                          x.name.lower()))
+        from batzenca.session import session
+        res = session.db_session.query(Peer, Key.name).join(Key, Key.peer_id == Peer.id).join(ReleaseKeyAssociation).filter(ReleaseKeyAssociation.right_id == self.id,
+                                                                                                                            ReleaseKeyAssociation.is_active == True)
+        return tuple(peer for peer, name in sorted(res, key=lambda x: x[1].lower()))
+
+    def peers_last_seen(self):
+        """Return when the active peers of this release were last seen on this mailing list.
+
+        This is computed by a single query over all releases of this release's mailing list.
+
+        :return: a dictionary mapping the id of each active peer in this release which had a key in
+            any other release on this mailing list to a pair ``(date, in_prev)``. The first entry is
+            the most recent date of such a release, the second is ``True`` if the peer had an
+            active key in the previous release.
+
+        """
+        from batzenca.session import session
+        from sqlalchemy import func, case
+        from sqlalchemy.sql import and_
+
+        query = session.db_session.query
+
+        active_peers = query(Key.peer_id).join(ReleaseKeyAssociation).filter(ReleaseKeyAssociation.right_id == self.id,
+                                                                             ReleaseKeyAssociation.is_active == True,
+                                                                             Key.peer_id != None).subquery()
+
+        in_prev = case([(and_(Release.id == self.previous_release_id, ReleaseKeyAssociation.is_active == True), 1)], else_=0)
+
+        res = query(Key.peer_id, func.max(Release.date), func.max(in_prev))
+        res = res.select_from(ReleaseKeyAssociation).join(Key, ReleaseKeyAssociation.left_id == Key.id).join(Release, ReleaseKeyAssociation.right_id == Release.id)
+        res = res.filter(Release.mailinglist_id == self.mailinglist_id, Release.id != self.id, Key.peer_id.in_(active_peers))
+        res = res.group_by(Key.peer_id)
+
+        return dict((peer_id, (date, bool(was_in_prev))) for peer_id, date, was_in_prev in res)
 
     @staticmethod
     def _format_entry(i, key):
         return (u"  %3d. %s"%(i, key), u"       %s"%key.peer)
 
+    def _membership(self):
+        """Return a pair ``(active_keys, inactive_keys)`` of tuples.
+
+        For releases which were written to the database this is computed by a single query unless
+        the associations and their keys are loaded already, e.g. by
+        :func:`batzenca.database.releases.Release.load`. The result is cached until the association
+        collection is modified through this release or the master session is committed or rolled
+        back.
+        """
+        if self.id is None or self._associations_loaded():
+            return (tuple(assoc.key for assoc in self.key_associations if assoc.is_active),
+                    tuple(assoc.key for assoc in self.key_associations if assoc.is_active is False))
+
+        from batzenca.session import session
+        cache = self._membership_cache
+        if cache is not None and cache[0] == session.db_generation:
+            return cache[1]
+
+        res = session.db_session.query(Key, ReleaseKeyAssociation.is_active).join(ReleaseKeyAssociation).filter(ReleaseKeyAssociation.right_id == self.id)
+        active, inactive = [], []
+        for key, is_active in res:
+            if is_active:
+                active.append(key)
+            elif is_active is False:
+                inactive.append(key)
+
+        membership = (tuple(active), tuple(inactive))
+        self._membership_cache = (session.db_generation, membership)
+        return membership
+
+    def _invalidate_membership(self):
+        self._membership_cache = None
+
+    def _expire_associations(self, deleted=()):
+        """Expire associations of this release after they were modified by SQL statements.
+
+        :param iterable deleted: database ids of keys whose association with this release was
+            deleted, these associations are removed from the session
+
+        """
+        from sqlalchemy import inspect
+        from batzenca.session import session
+        db_session = session.db_session
+        deleted = set(deleted)
+
+        for obj in list(db_session.identity_map.values()):
+            if isinstance(obj, ReleaseKeyAssociation):
+                left_id, right_id = inspect(obj).identity
+                if right_id != self.id:
+                    continue
+                if left_id in deleted:
+                    db_session.expunge(obj)
+                else:
+                    db_session.expire(obj)
+            elif isinstance(obj, Key) and "release_associations" not in inspect(obj).unloaded:
+                db_session.expire(obj, ["release_associations"])
+        db_session.expire(self, ["key_associations"])
+        self._invalidate_membership()
+
+    def _associations_loaded(self):
+        """Return ``True`` if the associations of this release and their keys are loaded."""
+        from sqlalchemy import inspect
+        if "key_associations" in inspect(self).unloaded:
+            return False
+        return all("key" not in inspect(assoc).unloaded for assoc in self.key_associations)
+
+    @classmethod
+    def loader_options(cls, profile):
+        """Return query options which load releases according to the loading profile ``profile``.
+
+        :param str profile: the name of a loading profile, see :mod:`batzenca.database.loading`
+
+        Example::
+
+            >>> session.query(Release).options(*Release.loader_options("report"))
+
+        """
+        from loading import options
+        return options(profile)
+
+    def load(self, profile):
+        """Load all objects reachable from this release which are walked by the workflow ``profile``
+        by a bounded number of queries.
+
+        :param str profile: the name of a loading profile, see :mod:`batzenca.database.loading`
+
+        :return: this release
+
+        """
+        from batzenca.session import session
+        if self.id is None:
+            session.db_session.flush()
+        session.db_session.query(Release).options(*Release.loader_options(profile)).filter(Release.id == self.id).all()
+        return self
+
     @property
     def active_keys(self):
         """All active keys in this release."""
-        if self.id is None:
-            return [assoc for assoc in self.key_associations if assoc.is_active]
-        from batzenca.session import session
-        return session.db_session.query(Key).join(ReleaseKeyAssociation).filter(ReleaseKeyAssociation.right_id == self.id,
-                                                                                ReleaseKeyAssociation.is_active == True).all()
+        return list(self._membership()[0])
 
     @property
     def inactive_keys(self):
         """All inactive keys in this release."""
-        if self.id is None:
-            return [assoc.key for assoc in self.key_associations if not assoc.is_active]
-        from batzenca.session import session
-        return session.db_session.query(Key).join(ReleaseKeyAssociation).filter(ReleaseKeyAssociation.right_id == self.id,
-                                                                                ReleaseKeyAssociation.is_active == False).all()
+        return list(self._membership()[1])
 
     def deactivate_invalid(self):
         """Deactivate those keys which evaluate to false and those keys which are not signed by the
@@ -282,12 +479,21 @@ class Release(Base):
         if self.published:
             raise ValueError("Release '%s' is already published and should not be modified."%self)
 
-        for assoc in self.key_associations:
-            if assoc.is_active:
-                if not bool(assoc.key):
-                    assoc.is_active = False
-                elif not assoc.key.is_signed_by(self.policy.ca):
-                    assoc.is_active = False
+        from sqlalchemy.sql import and_
+        from batzenca.session import session
+        session.db_session.flush()
+
+        RKA = ReleaseKeyAssociation
+        ca = self.policy.ca
+        res = session.db_session.query(Key.id, Key.kid).join(RKA, RKA.left_id == Key.id).filter(RKA.right_id == self.id,
+                                                                                                 RKA.is_active == True)
+        invalid = [key_id for key_id, kid in res
+                   if not session.gnupg.key_okay(kid) or not session.gnupg.key_any_uid_is_signed_by(kid, ca.kid)]
+        if invalid:
+            table = RKA.__table__
+            session.db_session.execute(table.update().where(and_(table.c.right_id == self.id,
+                                                                 table.c.left_id.in_(invalid))).values(is_active=False))
+        self._expire_associations()
 
     def delete_old_inactive_keys(self, releasecount=5):
         """
@@ -300,20 +506,38 @@ class Release(Base):
             raise ValueError("Release '%s' is already published and should not be modified."%self)
 
         old_release = self
-        for i in range(releasecount):
-            if old_release.prev:
-                old_release = old_release.prev
-            else:
+        if releasecount:
+            ancestors = list(self.ancestors(releasecount))
+            if len(ancestors) < releasecount:
                 return
+            old_release = ancestors[-1]
+
+        from sqlalchemy.sql import and_
+        from sqlalchemy.orm import aliased
+        from batzenca.session import session
+        session.db_session.flush()
+
+        RKA = ReleaseKeyAssociation
+        old = aliased(RKA)
+        # inactive keys of this release and whether they were active in the old release
+        res = session.db_session.query(Key.id, Key.kid, old.left_id != None).join(RKA, RKA.left_id == Key.id)
+        res = res.outerjoin(old, and_(old.left_id == Key.id, old.right_id == old_release.id, old.is_active == True))
+        res = res.filter(RKA.right_id == self.id, RKA.is_active == False)
 
         delete_keys = []
-        for key in self.inactive_keys:
-            if key not in old_release.active_keys:
-                delete_keys.append(key)
-            elif key.expires and key.expires < self.date:
-                delete_keys.append(key)
-        for key in delete_keys:
-            self.delete_key(key)
+        for key_id, kid, was_active in res:
+            if not was_active:
+                delete_keys.append(key_id)
+            else:
+                expires = session.gnupg.key_expires(kid)
+                if expires and expires < self.date:
+                    delete_keys.append(key_id)
+
+        if delete_keys:
+            table = RKA.__table__
+            session.db_session.execute(table.delete().where(and_(table.c.right_id == self.id,
+                                                                 table.c.left_id.in_(delete_keys))))
+        self._expire_associations(deleted=delete_keys)
 
     def _get_assoc(self, key):
         if key.id is None or self.id is None:
@@ -342,6 +566,7 @@ class Release(Base):
 
         assoc = self._get_assoc(key)
         assoc.policy_exception = True
+        self._invalidate_membership()
 
     def has_exception(self, key):
         """
@@ -382,6 +607,7 @@ class Release(Base):
                 assoc.is_active = False
             else:
                 raise ValueError("Key '%s' of peer '%s' has a valid signature by CA '%s' mandated in '%s'"%(assoc.key, peer, self.policy.ca, self.policy))
+        self._invalidate_membership()
 
         self.add_key(peer.key, active=True, check=True)
 
@@ -406,7 +632,10 @@ class Release(Base):
         if check and active:
             self.policy.check(key)
 
+        # the key material may have changed since the key was last seen, e.g. its expiry was extended
+        key.refresh()
         self.key_associations.append(ReleaseKeyAssociation(key=key, active=active))
+        self._invalidate_membership()
 
     def delete_key(self, key):
         """
@@ -422,6 +651,7 @@ class Release(Base):
         self.key_associations.remove(assoc)
         from batzenca.session import session
         session.db_session.delete(assoc)
+        self._invalidate_membership()
 
     def __contains__(self, obj):
         from batzenca.session import session
@@ -465,11 +695,41 @@ class Release(Base):
         """
         The previous release.
         """
-        idx = self.mailinglist.releases.index(self)
-        if idx > 0:
-            return self.mailinglist.releases[idx-1]
-        else:
-            return None
+        return self.previous_release
+
+    def ancestors(self, n=None):
+        """Iterate over the releases preceding this release, most recent first.
+
+        The chain of previous releases is followed in the database, so the whole window is loaded by
+        one query.
+
+        :param int n: the maximum number of releases to return, if ``None`` all previous releases
+            are returned.
+
+        """
+        from batzenca.session import session
+        from sqlalchemy import literal
+        from sqlalchemy.orm import aliased
+
+        if self.previous_release is None or n == 0:
+            return iter(())
+
+        if self.previous_release_id is None:
+            session.db_session.flush()
+
+        query = session.db_session.query
+
+        chain = query(Release.id.label("id"),
+                      Release.previous_release_id.label("previous_release_id"),
+                      literal(1).label("depth")).filter(Release.id == self.previous_release_id).cte(name="chain", recursive=True)
+
+        parent = aliased(Release, name="parent")
+        step = query(parent.id, parent.previous_release_id, chain.c.depth + 1).filter(parent.id == chain.c.previous_release_id)
+        if n is not None:
+            step = step.filter(chain.c.depth < n)
+        chain = chain.union_all(step)
+
+        return iter(query(Release).join(chain, Release.id == chain.c.id).order_by(chain.c.depth).all())
 
     @property
     def yaml(self):
@@ -479,24 +739,44 @@ class Release(Base):
         key ids of active and passive keys.
 
         """
+        from batzenca import reports
+        from batzenca.session import session
+        if self.id is None:
+            session.db_session.flush()
+
         s = []
         s.append("mailinglist: %s"%self.mailinglist.email)
         s.append("date:        %04d-%02d-%02d"%(self.date.year, self.date.month, self.date.day))
         s.append("ca:          %s"%self.policy.ca.kid)
 
         s.append("active keys:")
-        for key in self.active_keys:
-            s.append("  - %s"%key.kid)
+        for row in reports.members(self, active=True):
+            s.append("  - %s"%row.kid)
         s.append("")
         s.append("inactive keys:")
-        for key in self.inactive_keys:
-            s.append("  - %s"%key.kid)
+        for row in reports.members(self, active=False):
+            s.append("  - %s"%row.kid)
         s.append("")
         return "\n".join(s)
 
     def expiring_keys(self, days=30):
-        return tuple(key for key in self.active_keys
-                     if key.expires and key.expires < self.date + datetime.timedelta(days=days))
+        """Return the active keys in this release which expire within ``days`` days after the date of
+        this release, or have expired already, ordered by their expiry date.
+
+        The cached :attr:`batzenca.database.keys.Key.expiry_date` is used, GnuPG is not queried.
+        Call :func:`batzenca.database.keys.Key.refresh_all` first if keys were modified directly
+        through ``session.gnupg``.
+
+        :param int days: the number of days
+        """
+        from batzenca.session import session
+        if self.id is None:
+            session.db_session.flush()
+        RKA = ReleaseKeyAssociation
+        query = session.db_session.query(Key).join(RKA, RKA.left_id == Key.id)
+        query = query.filter(RKA.right_id == self.id, RKA.is_active == True,
+                             Key.expiry_date < self.date + datetime.timedelta(days=days))
+        return tuple(query.order_by(Key.expiry_date, Key.id))
 
     def __call__(self, previous=None, check=True, still_alive=False):
         """Return tuple representing this release as a (message, keys) pair.
@@ -554,9 +834,9 @@ class Release(Base):
 
         return msg, self.ascii_keys
 
-    def release_message(self, previous=None, check=True, debug=False, attachments=None):
-        """
-        """
+    def _release_draft(self, previous=None, check=True, debug=False, attachments=None):
+        """Return the key update message for this release as a ``(payload, recipients, signer,
+        headers)`` tuple, see :func:`batzenca.pgpmime.PGPMIMEPool.submit`."""
         ca = self.policy.ca
         mailinglist = self.mailinglist
         date_str = "%04d%02d%02d"%(self.date.year, self.date.month, self.date.day)
@@ -567,7 +847,6 @@ class Release(Base):
         from email.mime.base import MIMEBase
         from email.mime.multipart import MIMEMultipart
         from email.mime.text import MIMEText
-        from batzenca.pgpmime import PGPMIME
 
         payload = MIMEMultipart()
         payload.attach(MIMEText(body_.encode('utf-8'),  _charset='utf-8'))
@@ -582,41 +861,47 @@ class Release(Base):
             for attachment in attachments:
                 payload.attach(attachment)
 
-        msg = PGPMIME(payload, self.active_keys, ca)
-
-        # we are being a bit paranoid and check that we didn't fuck up encryption or something
-        for key in self.active_keys:
-            assert(key.kid not in msg.as_string())
-
         to = mailinglist.email if not debug else ca.email
+        headers = (('To', to),
+                   ('From', ca.email),
+                   ('Subject', "KeyUpdate {date} [{mailinglist}]".format(date=date_str, mailinglist=mailinglist.name)))
+        return payload, self.active_keys, ca, headers
 
-        msg['To']      = to
-        msg['From']    = ca.email
-        msg['Subject'] = "KeyUpdate {date} [{mailinglist}]".format(date=date_str, mailinglist=mailinglist.name)
+    def release_message(self, previous=None, check=True, debug=False, attachments=None):
+        """Return the signed and encrypted key update message for this release.
 
-        return msg
+        :param batzenca.database.releases.Release previous: the previous release, if ``None`` then
+            ``self.prev`` is used.
+        :param boolean check: if ``True`` then :func:`batzenca.database.releases.Release.verify` is
+            run.
+        :param boolean debug: address the message to the CA instead of the list
+        :param iterable attachments: MIME objects which are attached to the message
 
-    def welcome_messages(self, tolerance=180, debug=False):
+        :raises batzenca.pgpmime.PlaintextLeak: if the key id or fingerprint of any active key
+            appears in the encrypted message, see :func:`batzenca.pgpmime.check_leaks`
+        """
+        from batzenca.pgpmime import PGPMIMEPool
+        payload, recipients, signer, headers = self._release_draft(previous, check, debug, attachments)
+        # we are being a bit paranoid and check that we didn't fuck up encryption or something
+        return PGPMIMEPool(1).submit(payload, recipients, signer, headers, check=True).get()
+
+    def _welcome_drafts(self, tolerance=180, debug=False):
+        """Return the welcome messages for this release as ``(payload, recipients, signer,
+        headers)`` tuples, see :func:`batzenca.pgpmime.PGPMIMEPool.submit`."""
         mailinglist = self.mailinglist
         ca = self.policy.ca
         today = datetime.date.today()
         tolerance = today - datetime.timedelta(days=tolerance)
 
         from email.mime.text import MIMEText
-        from batzenca.pgpmime import PGPMIME
 
+        last_seen = self.peers_last_seen()
 
         M = []
         for peer in self.peers:
-            was_recently_active = False
-            for key in peer.keys:
-                if key in self.prev:
-                    # sometimes previous releases were a long time ago
-                    was_recently_active = True
-                # now deal with any other releases
-                if any(rel.date > tolerance for rel in key.releases if rel.mailinglist == self.mailinglist and rel != self):
-                    was_recently_active = True
-                    break
+            date, in_prev = last_seen.get(peer.id, (None, False))
+            # sometimes previous releases were a long time ago
+            was_recently_active = in_prev or (date is not None and date > tolerance)
             if not was_recently_active:
                 body    = self.mailinglist.new_member_msg.format(peer=peer.name,
                                                                  mailinglist=mailinglist.name,
@@ -624,38 +909,83 @@ class Release(Base):
                                                                  ca=ca.name,
                                                                  ca_email=ca.email)
                 payload = MIMEText(body.encode('utf-8'),  _charset='utf-8')
-                msg = PGPMIME(payload, [peer.key, ca], ca)
                 to = peer.email if not debug else ca.email
-                msg['To']      = to
-                msg['From']    = ca.email
-                msg['Subject'] = "welcome to [{mailinglist}]".format(mailinglist=mailinglist.name)
-                M.append(msg)
+                headers = (('To', to),
+                           ('From', ca.email),
+                           ('Subject', "welcome to [{mailinglist}]".format(mailinglist=mailinglist.name)))
+                M.append((payload, [peer.key, ca], ca, headers))
         return tuple(M)
 
-    def key_expiry_messages(self, days=30, debug=False):
+    @staticmethod
+    def _seal_all(drafts, jobs=1, pool=None):
+        """Yield the signed and encrypted messages for ``drafts`` as they become ready."""
+        from batzenca.pgpmime import PGPMIMEPool
+        if pool is not None:
+            for msg in pool.imap_unordered(drafts):
+                yield msg
+        else:
+            with PGPMIMEPool(jobs) as pool:
+                for msg in pool.imap_unordered(drafts):
+                    yield msg
+
+    def welcome_messages(self, tolerance=180, debug=False, jobs=1, pool=None):
+        """Iterate over signed and encrypted welcome messages for peers who were not on this list
+        during the last ``tolerance`` days.
+
+        :param int tolerance: the number of days
+        :param boolean debug: address the messages to the CA instead of the peers
+        :param int jobs: the number of processes signing and encrypting messages, see
+            :class:`batzenca.pgpmime.PGPMIMEPool`
+        :param batzenca.pgpmime.PGPMIMEPool pool: a pool to use instead of starting ``jobs``
+            processes
+
+        :return: an iterator which yields each message as soon as it is encrypted, not
+            necessarily in the order of :attr:`batzenca.database.releases.Release.peers`
+        """
+        drafts = self._welcome_drafts(tolerance=tolerance, debug=debug)
+        return self._seal_all(drafts, jobs=jobs, pool=pool)
+
+    def _key_expiry_drafts(self, days=30, debug=False):
+        """Return the key expiry warnings for this release as ``(payload, recipients, signer,
+        headers)`` tuples, see :func:`batzenca.pgpmime.PGPMIMEPool.submit`."""
         mailinglist = self.mailinglist
         ca = self.policy.ca
 
         from email.mime.text import MIMEText
-        from batzenca.pgpmime import PGPMIME
 
         M = []
         for key in self.expiring_keys(days=days):
             body    = self.mailinglist.key_expiry_warning_msg.format(peer=key.peer.name,
                                                                      keyid=key.kid,
-                                                                     expiry_date=key.expires,
+                                                                     expiry_date=key.expiry_date,
                                                                      mailinglist = mailinglist.name,
                                                                      mailinglist_email = mailinglist.email,
                                                                      ca_email = ca.email)
             payload = MIMEText(body.encode('utf-8'),  _charset='utf-8')
-            msg = PGPMIME(payload, [key, ca], ca)
             to = key.email if not debug else ca.email
-            msg['To']      = to
-            msg['From']    = ca.email
-            msg['Subject'] = "key expiry warning".format(mailinglist=mailinglist.name)
-            M.append( msg )
+            headers = (('To', to),
+                       ('From', ca.email),
+                       ('Subject', "key expiry warning".format(mailinglist=mailinglist.name)))
+            M.append((payload, [key, ca], ca, headers))
         return tuple(M)
 
+    def key_expiry_messages(self, days=30, debug=False, jobs=1, pool=None):
+        """Iterate over signed and encrypted warnings for keys which expire within ``days`` days, see
+        :func:`batzenca.database.releases.Release.expiring_keys`.
+
+        :param int days: the number of days
+        :param boolean debug: address the messages to the CA instead of the key owners
+        :param int jobs: the number of processes signing and encrypting messages, see
+            :class:`batzenca.pgpmime.PGPMIMEPool`
+        :param batzenca.pgpmime.PGPMIMEPool pool: a pool to use instead of starting ``jobs``
+            processes
+
+        :return: an iterator which yields each message as soon as it is encrypted, not
+            necessarily in the order of expiry
+        """
+        drafts = self._key_expiry_drafts(days=days, debug=debug)
+        return self._seal_all(drafts, jobs=jobs, pool=pool)
+
 
     def dump(self, filename=None):
         """Write this release to to filename.yaml and filename.asc where the
@@ -675,8 +1005,70 @@ class Release(Base):
         open(filename+".asc", "w").write( self(previous=None, check=False)[1] )
 
 
+    def prepare(self, previous=None, check=True, debug=False, attachments=None,
+                new_peer_tolerance_days=180, key_expiry_warning_days=30, pool=None):
+        """Prepare publishing this release.
+
+        This entails steps 1 to 5 of :func:`batzenca.database.releases.Release.send` except that
+        no e-mail is sent: all messages are rendered and submitted to ``pool`` for signing and
+        encryption. The messages are sent by passing the returned object to
+        :func:`batzenca.database.releases.Release.send`. The parameters are as for
+        :func:`batzenca.database.releases.Release.send` and
+
+        :param batzenca.pgpmime.PGPMIMEPool pool: the pool which signs and encrypts messages, if
+            ``None`` this happens in the calling process before this function returns.
+
+        :return: a :class:`batzenca.database.releases.PreparedRelease`
+
+        .. note::
+
+            Messages are rendered in the calling process as this requires access to the database;
+            only signing and encrypting, which dominates the cost, is done by ``pool``. Hence, when
+            preparing many releases, the next release is rendered while the messages of the
+            previous ones are being encrypted.
+        """
+        from batzenca.pgpmime import PGPMIMEPool
+
+        if self.published:
+            raise ValueError("Release '%s' is already published"%self)
+
+        if pool is None:
+            pool = PGPMIMEPool(1)
+
+        # 1. updating the release date of this release
+
+        if not debug:
+            self.date = datetime.date.today()
+
+        # 2. a call to :func:`batzenca.database.releases.Release.deactivate_invalid`
+
+        self.deactivate_invalid()
+
+        # deactivate_invalid expires the key associations, so they are loaded afterwards
+        self.load("publish")
+
+        # 3. e-mails to new members who have not been on this list for ``new_peer_tolerance_days`` days.
+
+        welcome = []
+        if new_peer_tolerance_days and self.mailinglist.new_member_msg:
+            welcome = [pool.submit(*draft) for draft in self._welcome_drafts(tolerance=new_peer_tolerance_days, debug=debug)]
+
+        # 4. the key update message to the list
+
+        payload, recipients, signer, headers = self._release_draft(previous=previous, check=check, debug=debug, attachments=attachments)
+        update = pool.submit(payload, recipients, signer, headers, check=True)
+
+        # 5. key expiry messages to keys that expire within ``key_expiry_warning_days`` days
+
+        expiry = []
+        if key_expiry_warning_days and self.mailinglist.key_expiry_warning_msg:
+            Key.refresh_all(self.active_keys)
+            expiry = [pool.submit(*draft) for draft in self._key_expiry_drafts(days=key_expiry_warning_days, debug=debug)]
+
+        return PreparedRelease(self, debug, welcome, update, expiry)
+
     def send(self, smtpserver, previous=None, check=True, debug=False, attachments=None,
-             new_peer_tolerance_days=180, key_expiry_warning_days=30):
+             new_peer_tolerance_days=180, key_expiry_warning_days=30, prepared=None):
         """Publish this release.
 
         This entails (if ``debug==False``):
@@ -708,6 +1100,10 @@ class Release(Base):
         :param iterable attachments:
         :param int new_peer_tolerance_days:
         :param int key_expiry_warning_days:
+        :param batzenca.database.releases.PreparedRelease prepared: the output of
+            :func:`batzenca.database.releases.Release.prepare`, steps 1 to 5 are then taken from it
+            and all other parameters except ``smtpserver`` are ignored. If ``None``, this function
+            calls :func:`batzenca.database.releases.Release.prepare` first.
 
         .. warning:
 
@@ -717,43 +1113,40 @@ class Release(Base):
             :attr:`batzenca.database.releases.Release.published` is set to ``True``.
 
         """
+        if prepared is None:
+            prepared = self.prepare(previous=previous, check=check, debug=debug, attachments=attachments,
+                                    new_peer_tolerance_days=new_peer_tolerance_days,
+                                    key_expiry_warning_days=key_expiry_warning_days)
+        elif prepared.release is not self:
+            raise ValueError("Release '%s' was prepared but '%s' is sent."%(prepared.release, self))
+
         if self.published:
             raise ValueError("Release '%s' is already published"%self)
 
-        # 1. updating the release date of this release
-
-        if not debug:
-            self.date = datetime.date.today()
-
-        # 2. a call to :func:`batzenca.database.releases.Release.deactivate_invalid`
-
-        self.deactivate_invalid()
+        debug = prepared.debug
+        ca_email = self.policy.ca.email
 
         # 3. sending an e-mail to new members who have not been on this list for ``new_peer_tolerance_days`` days.
 
-        if new_peer_tolerance_days and self.mailinglist.new_member_msg:
-            messages = self.welcome_messages(tolerance=new_peer_tolerance_days, debug=debug)
-            for msg in messages:
-                if debug:
-                    smtpserver.sendmail(self.policy.ca.email, (msg['To'],self.policy.ca.email), msg.as_string())
-                else: # we send a copy to self
-                    smtpserver.sendmail(self.policy.ca.email, (self.policy.ca.email, ), msg.as_string())
+        for msg in prepared.welcome_messages():
+            if debug:
+                smtpserver.sendmail(ca_email, (msg['To'], ca_email), msg.as_string())
+            else: # we send a copy to self
+                smtpserver.sendmail(ca_email, (ca_email, ), msg.as_string())
 
         # 4. sending a key update message to the list
 
-        msg = self.release_message(previous=previous, check=check, debug=debug, attachments=attachments)
-        smtpserver.sendmail(self.policy.ca.email, (msg['To'],), msg.as_string())
+        msg = prepared.release_message()
+        smtpserver.sendmail(ca_email, (msg['To'],), msg.as_string())
 
         # 5. sending a key expiry message to keys that expire within ``key_expiry_warning_days`` days
 
-        if key_expiry_warning_days and self.mailinglist.key_expiry_warning_msg:
-            messages = self.key_expiry_messages(days=key_expiry_warning_days, debug=debug)
-            for msg in messages:
-                if debug:
-                    smtpserver.sendmail(self.policy.ca.email, (self.policy.ca.email,), msg.as_string())
-                else:
-                    # we send a copy to self
-                    smtpserver.sendmail(self.policy.ca.email, (msg['To'],self.policy.ca.email), msg.as_string())
+        for msg in prepared.key_expiry_messages():
+            if debug:
+                smtpserver.sendmail(ca_email, (ca_email,), msg.as_string())
+            else:
+                # we send a copy to self
+                smtpserver.sendmail(ca_email, (msg['To'], ca_email), msg.as_string())
 
         # 6. a call to :func:`batzenca.database.releases.Release.dump`
 
@@ -764,3 +1157,69 @@ class Release(Base):
 
         if not debug:
             self.published = True
+
+
+@event.listens_for(DBSession, "before_flush")
+def _unlink_deleted_releases(db_session, flush_context, instances):
+    """Link the successors of deleted releases and their mailing lists to the nearest release which
+    is not deleted."""
+    deleted = set(obj for obj in db_session.deleted if isinstance(obj, Release))
+    if not deleted:
+        return
+
+    from mailinglists import MailingList
+
+    def survivor(release):
+        while release in deleted:
+            release = release.previous_release
+        return release
+
+    ids = [release.id for release in deleted if release.id is not None]
+    successors = set(obj for obj in db_session.new if isinstance(obj, Release) and obj.previous_release in deleted)
+    mailinglists = set()
+    if ids:
+        successors.update(db_session.query(Release).filter(Release.previous_release_id.in_(ids)))
+        mailinglists.update(db_session.query(MailingList).filter(MailingList.current_release_id.in_(ids)))
+    mailinglists.update(release.mailinglist for release in deleted
+                        if release.mailinglist is not None and release.mailinglist._current_release in deleted)
+
+    for release in successors - deleted:
+        release.previous_release = survivor(release.previous_release)
+    for mailinglist in mailinglists:
+        mailinglist._current_release = survivor(mailinglist._current_release)
+
+
+class PreparedRelease(object):
+    """The messages of a release which is about to be published, as returned by
+    :func:`batzenca.database.releases.Release.prepare`.
+
+    The messages may still be being signed and encrypted, the functions of this class wait for them.
+    """
+    def __init__(self, release, debug, welcome, update, expiry):
+        self.release = release
+        self.debug = debug
+        self._welcome = tuple(welcome)
+        self._update = update
+        self._expiry = tuple(expiry)
+
+    def welcome_messages(self):
+        """Return the signed and encrypted welcome messages for new members."""
+        return tuple(pending.get() for pending in self._welcome)
+
+    def release_message(self):
+        """Return the signed and encrypted key update message.
+
+        :raises batzenca.pgpmime.PlaintextLeak: if the key id or fingerprint of any active key
+            appears in the encrypted message
+        """
+        return self._update.get()
+
+    def key_expiry_messages(self):
+        """Return the signed and encrypted key expiry warnings."""
+        return tuple(pending.get() for pending in self._expiry)
+
+    def wait(self):
+        """Wait until all messages are signed and encrypted."""
+        self.welcome_messages()
+        self.release_message()
+        self.key_expiry_messages()
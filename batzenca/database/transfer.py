@@ -0,0 +1,105 @@
+"""
+.. module:: transfer
+
+.. moduleauthor:: Martin R. Albrecht <martinralbrecht+batzenca@googlemail.com>
+
+Copy a database into another database backend.
+
+For example, to move the SQLite database of the current session to a local PostgreSQL database::
+
+    >>> from batzenca.database.transfer import copy_database
+    >>> copy_database(session.db_engine, "postgresql://localhost/batzenca")
+
+Afterwards, point the session to the new database in ``$BATZENCADIR/batzenca.cfg``, see
+:attr:`batzenca.session.Session.db_url`.
+"""
+
+import sqlalchemy
+
+from base import Base
+from migrations import schema_version, current_version, head, upgrade
+
+
+def _engine(engine):
+    if isinstance(engine, basestring):
+        return sqlalchemy.create_engine(engine)
+    return engine
+
+
+def _deferred_columns(table):
+    """Return the names of the columns of ``table`` which reference ``table`` itself or are part of
+    a dependency cycle between tables. These are filled in after all rows are copied."""
+    return tuple(fk.parent.name for fk in table.foreign_keys
+                 if fk.column.table is table or fk.use_alter or fk.constraint.use_alter)
+
+
+def copy_database(source, target, batch_size=1000):
+    """Copy all rows from the database ``source`` to the empty database ``target``.
+
+    The schema of ``target`` is created if necessary. Primary keys are preserved. On PostgreSQL the
+    sequences generating primary keys are advanced past the copied rows.
+
+    :param source: an SQLAlchemy engine or database URL, the database must have the most recent
+        schema version
+    :param target: an SQLAlchemy engine or database URL
+    :param int batch_size: the number of rows read and written at a time
+
+    :return: a dictionary mapping table names to the number of copied rows
+
+    """
+    source, target = _engine(source), _engine(target)
+
+    version = current_version(source)
+    if version != head():
+        raise RuntimeError("The source database has schema version %d but version %d is required."%(version, head()))
+
+    upgrade(target)
+
+    tables = [table for table in Base.metadata.sorted_tables if table is not schema_version]
+    counts = {}
+
+    with target.begin() as connection:
+        for table in tables:
+            if connection.execute(sqlalchemy.select([sqlalchemy.func.count()]).select_from(table)).scalar():
+                raise ValueError("Table '%s' of the target database is not empty."%table.name)
+
+        deferred = {}
+        for table in tables:
+            columns = _deferred_columns(table)
+            primary_key = [column.name for column in table.primary_key.columns]
+            updates = []
+            counts[table.name] = 0
+
+            result = source.execution_options(stream_results=True).execute(table.select())
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                rows = [dict(row) for row in rows]
+                for row in rows:
+                    if any(row[name] is not None for name in columns):
+                        update = dict(("_" + name, row[name]) for name in primary_key + list(columns))
+                        updates.append(update)
+                        for name in columns:
+                            row[name] = None
+                connection.execute(table.insert(), rows)
+                counts[table.name] += len(rows)
+            deferred[table] = (columns, primary_key, updates)
+
+        for table, (columns, primary_key, updates) in deferred.items():
+            if not updates:
+                continue
+            where = sqlalchemy.and_(*[table.c[name] == sqlalchemy.bindparam("_" + name) for name in primary_key])
+            values = dict((name, sqlalchemy.bindparam("_" + name)) for name in columns)
+            connection.execute(table.update().where(where).values(**values), updates)
+
+        if connection.dialect.name == "postgresql":
+            # only single column integer primary keys are generated by sequences
+            for table in tables:
+                columns = list(table.primary_key.columns)
+                if len(columns) != 1 or not isinstance(columns[0].type, sqlalchemy.Integer):
+                    continue
+                statement = "SELECT setval(pg_get_serial_sequence(:table, :column), (SELECT COALESCE(MAX(%s), 0) + 1 FROM %s), false)"
+                connection.execute(sqlalchemy.text(statement%(columns[0].name, table.name)), table=table.name, column=columns[0].name)
+
+    return counts
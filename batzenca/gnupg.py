@@ -16,9 +16,13 @@ import pyme.constants.status
 
 from collections import namedtuple
 UID = namedtuple('UID', ['name', 'email',  'comment'])
+KeyInfo = namedtuple('KeyInfo', ['keyid', 'fpr', 'length', 'algorithms', 'expires', 'signatures', 'sign_keys'])
 
 import os
 import datetime
+import functools
+
+from database.base import ReadOnlyError
 
 class KeyError(Exception):
     """
@@ -26,10 +30,22 @@ class KeyError(Exception):
     """
     pass
 
+def mutating(method):
+    """Decorator for methods of :class:`batzenca.gnupg.GnuPG` which modify the keyring, these raise a
+    :class:`batzenca.database.base.ReadOnlyError` on read-only instances."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwds):
+        if self.readonly:
+            raise ReadOnlyError("The GnuPG keyring in '%s' was opened read-only."%self.home_dir)
+        return method(self, *args, **kwds)
+    return wrapper
+
 class GnuPG(object):
     """A GnuPG context.
 
     :param str home_dir: specifiy ``GNUPGHOME``, if ``None`` an implementation default is used.
+    :param bool readonly: if ``True`` all methods which modify the keyring raise a
+        :class:`batzenca.database.base.ReadOnlyError` and ``home_dir`` is not created.
 
     """
     GPGME_PK_RSA   = pyme.pygpgme.GPGME_PK_RSA
@@ -53,8 +69,6 @@ class GnuPG(object):
                    "GPGME_PK_DSA"  : GPGME_PK_DSA,
                    "GPGME_PK_ELG"  : GPGME_PK_ELG }
 
-    _key_cache = {}
-
     @staticmethod
     def is_active(subkey):
         """
@@ -65,20 +79,28 @@ class GnuPG(object):
         """
         return not (subkey.revoked or subkey.expired or subkey.disabled)
 
-    def __init__(self, home_dir=None):
+    def __init__(self, home_dir=None, readonly=False):
         pyme.core.check_version(None)
 
         self._home_dir = home_dir
+        self.readonly = readonly
+        # we are caching keys per context as each context may have its own home directory
+        self._key_cache = {}
+
+        self.ctx = pyme.core.Context()
 
         if home_dir is not None:
             if not os.path.exists(home_dir):
+                if readonly:
+                    raise IOError("GnuPG home directory '%s' does not exist."%home_dir)
                 os.mkdir(home_dir)
                 os.chmod(home_dir, 0700)
 
+            # the home directory is set for this context only, so that several instances with
+            # different home directories may coexist in one process
             for engine in pyme.core.get_engine_info():
-                pyme.core.set_engine_info(engine.protocol, engine.file_name, home_dir)
+                pyme.pygpgme.gpgme_ctx_set_engine_info(self.ctx.wrapped, engine.protocol, engine.file_name, home_dir)
 
-        self.ctx = pyme.core.Context()
         self.ctx.set_keylist_mode(pyme.constants.keylist.mode.SIGS)
         self.ctx.set_armor(1)
 
@@ -263,18 +285,21 @@ class GnuPG(object):
         """
         key = self.key_get(keyid)
 
-        signer_key = self.key_get(signer_keyid)
-
-        sign_keys = set()
-        for subkey in signer_key.subkeys:
-            if subkey.can_sign and not subkey.disabled and not subkey.revoked:
-                sign_keys.add(subkey.keyid)
-
-        if sign_keys.intersection(self.key_signatures(keyid)):
+        if self.key_sign_keys(signer_keyid).intersection(self.key_signatures(keyid)):
             return True
         else:
             return False
 
+    def key_sign_keys(self, keyid):
+        """
+        Return the set of subkey ids of ``keyid`` which may be used to issue signatures.
+
+        :param keyid: see :func:`batzenca.gnupg.GnuPG.key_get` for accepted formats.
+        """
+        key = self.key_get(keyid)
+        return set(subkey.keyid for subkey in key.subkeys
+                   if subkey.can_sign and not subkey.disabled and not subkey.revoked)
+
     def key_signatures(self, keyid):
         """
         Return the list of keyids which match keys that signed the key ``keyid``.
@@ -305,6 +330,76 @@ class GnuPG(object):
         return key.subkeys[0].fpr
 
 
+    #: if more keys than this are requested by :func:`batzenca.gnupg.GnuPG.keys_info` and not
+    #: cached, the whole keyring is listed once instead of fetching each key
+    keylist_threshold = 32
+
+    def keys_cache_all(self):
+        """
+        List the keyring once and cache all keys in it, afterwards all keys can be looked up by key
+        ids of the form ``0x`` followed by 16 lower case hexadecimal digits without querying GnuPG.
+
+        :return: the number of keys in the keyring
+        """
+        count = 0
+        for key in self.ctx.op_keylist_all(None, 0):
+            self._key_cache["0x%s"%key.subkeys[0].keyid.lower()] = key
+            count += 1
+        return count
+
+    def keys_info(self, keyids, ignore_missing=False):
+        """
+        Return a dictionary mapping each of ``keyids`` to a :class:`batzenca.gnupg.KeyInfo` tuple
+        with the length, algorithms, expiry date, signatures and signing subkeys of that key.
+
+        Keys which are not cached are fetched one by one if there are at most
+        :attr:`batzenca.gnupg.GnuPG.keylist_threshold` of them. Otherwise the keyring is listed
+        once and all its keys are cached, see :func:`batzenca.gnupg.GnuPG.keys_cache_all`.
+
+        :param keyids: an iterable of key ids, see :func:`batzenca.gnupg.GnuPG.key_get` for
+            accepted formats.
+        :param boolean ignore_missing: if ``True`` keys which are not in the keyring are left out
+            of the result
+
+        :raises batzenca.gnupg.KeyError: if any key is not in the keyring and ``ignore_missing`` is
+            ``False``
+        """
+        def to_int(keyid):
+            if isinstance(keyid, basestring):
+                keyid = int(keyid[2:] if keyid[:2] in ("0x", "0X") else keyid, 16)
+            return keyid % (1<<64)
+
+        keyids = list(keyids)
+        missing = [keyid for keyid in keyids if keyid not in self._key_cache]
+        absent = set()
+        if len(missing) > self.keylist_threshold:
+            self.keys_cache_all()
+            for keyid in missing:
+                key = self._key_cache.get("0x%016x"%to_int(keyid))
+                if key is None:
+                    absent.add(keyid)
+                else:
+                    self._key_cache[keyid] = key
+        else:
+            for keyid in missing:
+                try:
+                    self.key_get(keyid)
+                except KeyError:
+                    absent.add(keyid)
+        if absent:
+            if not ignore_missing:
+                raise KeyError("Key '%s' not found."%sorted(absent)[0])
+            keyids = [keyid for keyid in keyids if keyid not in absent]
+
+        return dict((keyid, KeyInfo(keyid=keyid,
+                                    fpr=self.key_fingerprint(keyid),
+                                    length=self.key_min_len(keyid),
+                                    algorithms=self.key_pubkey_algos(keyid),
+                                    expires=self.key_expires(keyid),
+                                    signatures=frozenset(self.key_signatures(keyid)),
+                                    sign_keys=frozenset(self.key_sign_keys(keyid))))
+                    for keyid in keyids)
+
     def key_okay_encrypt(self, keyid):
         """
         Return ``True`` if the key ``keyid`` can be used for encryption.
@@ -415,6 +510,7 @@ class GnuPG(object):
 
         return tuple(sigs)
 
+    @mutating
     def key_sign(self, keyid, signer_keyid, local=False):
         """
         Sign all user IDs of a key.
@@ -449,6 +545,7 @@ class GnuPG(object):
         self.ctx.op_edit(key, edit_fnc, helper, out)
         self._key_cache = {} # invalidate the cache
 
+    @mutating
     def key_delete_signature(self, keyid, signer_keyid):
         """
         Delete a specific signature from a key.
@@ -487,6 +584,7 @@ class GnuPG(object):
 
         self._key_cache = {} # invalidate the cache
 
+    @mutating
     def key_set_trust(self, keyid, trust):
         """
         Set the owner trust of a key.
@@ -516,6 +614,7 @@ class GnuPG(object):
         self.ctx.op_edit(key, edit_fnc, helper, out)
         self._key_cache = {} # invalidate the cache
 
+    @mutating
     def keys_import(self, data):
         """
         Import the keys from data.
@@ -529,6 +628,7 @@ class GnuPG(object):
         res =  self.ctx.op_import_result()
         return dict((r.fpr, r.status) for r in res.imports)
 
+    @mutating
     def key_revsig(self, keyid, signer_keyid, code=4, msg=""):
         """
         Add a revocation signature for ``signer_keyid`` to ``keyid``.
@@ -578,6 +678,7 @@ class GnuPG(object):
         self.ctx.op_edit(key, edit_fnc, helper, out)
         self._key_cache = {} # invalidate the cache
 
+    @mutating
     def key_edit(self, keyid):
         """
         Edit a key.
@@ -19,17 +19,25 @@ from email.mime.base import MIMEBase
 import email
 
 import os
+import re
+import sys
 import mimetypes
 
 from batzenca.session import session
 
 
+def _kid(key):
+    """Return the key id of ``key`` which is either a :class:`batzenca.database.keys.Key` or a key
+    id already."""
+    return getattr(key, "kid", key)
+
+
 class PGPMIMEsigned(MIMEMultipart):
     """
     A MIME-type for PGP/MIME signed messages.
 
     :param msg: a MIME object
-    :param batzenca.database.keys.Key signer: the signing key
+    :param signer: the signing key as a :class:`batzenca.database.keys.Key` or a key id
     """
     def __init__(self, msg=None, signer=None):
         if msg is None:
@@ -41,7 +49,7 @@ class PGPMIMEsigned(MIMEMultipart):
 
         if signer is not None:
             msg_str = flatten(msg)
-            sig     = session.gnupg.msg_sign(msg_str, signer.kid)
+            sig     = session.gnupg.msg_sign(msg_str, _kid(signer))
             sig = MIMEApplication(_data=sig,
                                   _subtype='pgp-signature; name="signature.asc"',
                                   _encoder=encode_7or8bit)
@@ -82,9 +90,9 @@ class PGPMIMEsigned(MIMEMultipart):
         res = []
         for sig in sigs:
             try:
-                key = Key.from_keyid(int(sig[-16:],16))
+                key = Key.from_keyid(sig)
             except EntryNotFound:
-                key = Key(int(sig[-16:],16))
+                key = Key(sig)
             res.append(key)
         return tuple(res)
 
@@ -113,13 +121,13 @@ class PGPMIMEencrypted(MIMEMultipart):
 
     :param msg: a MIME object
     :param iterable recipients: an iterable of recipients, where each entry is a
-        :class:`batzenca.database.keys.Key` object.
+        :class:`batzenca.database.keys.Key` object or a key id.
     """
     def __init__(self, msg, recipients):
         MIMEMultipart.__init__(self, 'encrypted', micalg='pgp-sha1', protocol='application/pgp-encrypted')
 
         body = flatten(msg)
-        encrypted = session.gnupg.msg_encrypt(body, [r.kid for r in recipients])
+        encrypted = session.gnupg.msg_encrypt(body, [_kid(r) for r in recipients])
 
         payload = MIMEApplication(_data=encrypted,
                                   _subtype='octet-stream',
@@ -171,6 +179,206 @@ def PGPMIME(msg, recipients, signer):
     """
     return PGPMIMEencrypted( PGPMIMEsigned(msg, signer), recipients)
 
+class PlaintextLeak(RuntimeError):
+    """This exception is raised if an encrypted message contains the key id or fingerprint of one of
+    its recipients in plain text, which indicates that the message was not encrypted properly.
+
+    :param iterable leaks: the key ids of the recipients which were found
+    """
+    def __init__(self, leaks):
+        RuntimeError.__init__(self, tuple(leaks))
+        self.leaks = tuple(leaks)
+
+    def __str__(self):
+        return "The encrypted message contains the key id or fingerprint of %s in plain text."%", ".join(self.leaks)
+
+
+# runs of at least 16 hex digits and fingerprints in groups of four as printed by GnuPG
+_HEX_RUN = re.compile(r"[0-9A-Fa-f]{16,}|(?:[0-9A-Fa-f]{4} {1,2}){9}[0-9A-Fa-f]{4}")
+
+
+def find_leaks(msg, keys):
+    """Return the key ids of those ``keys`` whose key id or fingerprint appears in ``msg``.
+
+    ``msg`` is flattened once and scanned in a single pass for runs of hexadecimal digits, every
+    window of such a run is then looked up in the sets of key ids and fingerprints. Hence, the cost
+    is linear in the size of ``msg`` and independent of the number of keys.
+
+    :param msg: a MIME object or a string
+    :param iterable keys: :class:`batzenca.database.keys.Key` objects, key ids or ``(key id,
+        fingerprint)`` pairs
+    """
+    keyids, fprs = {}, {}
+    for key in keys:
+        if isinstance(key, tuple):
+            kid, fpr = key
+        else:
+            kid, fpr = _kid(key), getattr(key, "fpr", None)
+        keyids[kid[-16:].upper()] = kid
+        if fpr:
+            fprs[fpr.replace(" ", "").upper()] = kid
+
+    if not isinstance(msg, basestring):
+        msg = msg.as_string()
+
+    leaks = set()
+    for match in _HEX_RUN.finditer(msg):
+        run = match.group(0).replace(" ", "").upper()
+        for i in range(len(run) - 15):
+            kid = keyids.get(run[i:i+16]) or fprs.get(run[i:i+40])
+            if kid is not None:
+                leaks.add(kid)
+    return tuple(sorted(leaks))
+
+
+def check_leaks(msg, keys):
+    """Raise a :class:`batzenca.pgpmime.PlaintextLeak` if the key id or fingerprint of any of
+    ``keys`` appears in ``msg``, see :func:`batzenca.pgpmime.find_leaks`.
+
+    :param msg: a MIME object or a string
+    :param iterable keys: :class:`batzenca.database.keys.Key` objects, key ids or ``(key id,
+        fingerprint)`` pairs
+    """
+    leaks = find_leaks(msg, keys)
+    if leaks:
+        raise PlaintextLeak(leaks)
+
+
+class PendingMessage(object):
+    """A message which is being signed and encrypted by a :class:`batzenca.pgpmime.PGPMIMEPool`.
+
+    :param result: an object whose ``get()`` method returns the encrypted message
+    """
+    def __init__(self, result):
+        self._result = result
+
+    def get(self):
+        """Wait for and return the signed and encrypted message."""
+        return self._result.get()
+
+
+class _Done(object):
+    """The result of a function called in this process, which mimics
+    :class:`multiprocessing.pool.AsyncResult` including re-raising exceptions in ``get()``."""
+    def __init__(self, fn, *args):
+        self._value, self._exc_info = None, None
+        try:
+            self._value = fn(*args)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+    def get(self):
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+
+def _pool_init(path):
+    from batzenca.session import Session, _bind_worker
+    _bind_worker(Session(path, readonly=True))
+
+
+def _pool_seal(msg, recipients, signer, headers=(), check=()):
+    msg = PGPMIME(msg, recipients, signer)
+    if check:
+        check_leaks(msg, check)
+    for name, value in headers:
+        msg[name] = value
+    return msg
+
+
+def _pool_seal_star(args):
+    return _pool_seal(*args)
+
+
+class PGPMIMEPool(object):
+    """A pool of worker processes which sign and encrypt messages, see
+    :func:`batzenca.pgpmime.PGPMIME`.
+
+    Signing and encrypting is the expensive part of publishing releases. Messages are rendered in
+    the calling process and submitted to this pool, which signs and encrypts them while the caller
+    renders the next message. Each worker opens the GnuPG keyring of the session read-only::
+
+        >>> with PGPMIMEPool(4) as pool:
+        ...     pending = [pool.submit(payload, keys, ca, [("To", email)]) for payload, keys, email in drafts]
+        ...     messages = [p.get() for p in pending]
+
+    :param int processes: the number of worker processes, by default the number of CPUs. If ``1``
+        messages are signed and encrypted in the calling process when they are submitted.
+    :param str path: the directory of the session whose GnuPG keyring the workers use, by default
+        that of the current session
+    """
+    def __init__(self, processes=None, path=None):
+        import multiprocessing
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self._pool = None
+        if processes > 1:
+            if path is None:
+                path = session.path
+            self._pool = multiprocessing.Pool(processes, initializer=_pool_init, initargs=(path,))
+
+    def submit(self, msg, recipients, signer, headers=(), check=False):
+        """Sign ``msg`` by ``signer`` and encrypt it for ``recipients``.
+
+        :param msg: the message to be signed and encrypted
+        :param iterable recipients: :class:`batzenca.database.keys.Key` objects or key ids
+        :param signer: a :class:`batzenca.database.keys.Key` object or a key id
+        :param iterable headers: ``(name, value)`` pairs which are added to the encrypted message
+        :param boolean check: if ``True`` the encrypted message is checked for key ids and
+            fingerprints of ``recipients`` by the worker, see :func:`batzenca.pgpmime.check_leaks`.
+            A :class:`batzenca.pgpmime.PlaintextLeak` is then raised when the message is retrieved.
+
+        :return: a :class:`batzenca.pgpmime.PendingMessage`
+        """
+        leak_check = ()
+        if check:
+            leak_check = tuple((_kid(recipient), getattr(recipient, "fpr", None)) for recipient in recipients)
+        args = (msg, [_kid(recipient) for recipient in recipients], _kid(signer), tuple(headers), leak_check)
+        if self._pool is None:
+            return PendingMessage(_Done(_pool_seal, *args))
+        return PendingMessage(self._pool.apply_async(_pool_seal, args))
+
+    def imap_unordered(self, drafts):
+        """Sign and encrypt many messages and yield them as soon as they are ready.
+
+        :param iterable drafts: ``(msg, recipients, signer, headers)`` tuples, see
+            :func:`batzenca.pgpmime.PGPMIMEPool.submit`
+
+        :return: an iterator over signed and encrypted messages, not necessarily in the order of
+            ``drafts``
+        """
+        drafts = ((msg, [_kid(recipient) for recipient in recipients], _kid(signer), tuple(headers))
+                  for msg, recipients, signer, headers in drafts)
+        if self._pool is None:
+            return (_pool_seal(*draft) for draft in drafts)
+        return self._pool.imap_unordered(_pool_seal_star, list(drafts))
+
+    def close(self):
+        """Wait for all submitted messages and stop the workers."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def terminate(self):
+        """Stop the workers without waiting for submitted messages."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
 def flatten(msg):
     from cStringIO import StringIO
     from email.generator import Generator
@@ -0,0 +1,434 @@
+"""
+.. module:: reports
+
+.. moduleauthor:: Martin R. Albrecht <martinralbrecht+batzenca@googlemail.com>
+
+Read-only reporting over keys, peers, releases and their members.
+
+The functions in this module return plain rows, i.e. named tuples, instead of instances of
+:class:`batzenca.database.keys.Key` or :class:`batzenca.database.releases.Release`. Rows are
+streamed from the database in batches of ``batch_size`` and never enter the session's identity map,
+so reporting over many releases runs in constant memory::
+
+    >>> from batzenca import reports
+    >>> for row in reports.members(release, active=True):
+    ...     print row.kid, row.email
+
+All functions accept an optional ``session`` parameter, if ``None`` is given the master session is
+used.
+"""
+
+import datetime
+from collections import namedtuple
+from itertools import groupby
+
+from sqlalchemy import func, case, and_
+from sqlalchemy.orm import aliased
+
+from batzenca.database import Key, Peer, MailingList, Policy, Release
+from batzenca.database.releases import ReleaseKeyAssociation
+
+#: a key as stored in the database
+KeyRow = namedtuple("KeyRow", ("id", "kid", "name", "email", "timestamp", "peer_id"))
+
+#: a peer as stored in the database
+PeerRow = namedtuple("PeerRow", ("id", "name"))
+
+#: a release and the name of its mailing list
+ReleaseRow = namedtuple("ReleaseRow", ("id", "mailinglist", "date", "published", "previous_release_id"))
+
+#: a key in a release
+MemberRow = namedtuple("MemberRow", ("release_id", "key_id", "kid", "name", "email", "is_active", "policy_exception"))
+
+#: the number of active and inactive keys in a release
+SizeRow = namedtuple("SizeRow", ("release_id", "mailinglist", "date", "active", "inactive"))
+
+#: the number of active and inactive keys in a release and the number of keys which became active or
+#: stopped being active compared to the previous release
+HistoryRow = namedtuple("HistoryRow", ("release_id", "mailinglist", "date", "active", "inactive", "joined", "left"))
+
+#: the keys of a release which violate each rule, see :func:`batzenca.reports.audit`
+AuditRow = namedtuple("AuditRow", ("release_id", "mailinglist", "date", "published", "keys", "violations"))
+
+#: an active key in the current release of a mailing list and its expiry date
+ExpiryRow = namedtuple("ExpiryRow", ("mailinglist", "release_id", "key_id", "kid", "name", "email", "expiry_date"))
+
+#: the number of active keys of a mailing list expiring in the week starting at ``week``
+ExpiryHistogramRow = namedtuple("ExpiryHistogramRow", ("mailinglist", "week", "keys"))
+
+#: the number of active keys of a mailing list which have expired, which expire within the forecast
+#: period and the next date any key expires
+ExpiryForecastRow = namedtuple("ExpiryForecastRow", ("mailinglist", "active", "expired", "expiring", "next_expiry"))
+
+
+def _db_session(session):
+    if session is None:
+        from batzenca.session import session
+    return session.db_session
+
+
+def _stream(query, row_type, batch_size):
+    for row in query.yield_per(batch_size):
+        yield row_type._make(row)
+
+
+def keys(session=None, batch_size=1000):
+    """Iterate over all keys in the database ordered by their database id.
+
+    :param batzenca.session.Session session: the session to query, the master session if ``None``
+    :param int batch_size: the number of rows fetched from the database at a time
+
+    :return: an iterator over :class:`batzenca.reports.KeyRow` instances
+    """
+    query = _db_session(session).query(Key.id, Key.kid, Key.name, Key.email, Key.timestamp, Key.peer_id).order_by(Key.id)
+    return _stream(query, KeyRow, batch_size)
+
+
+def peers(session=None, batch_size=1000):
+    """Iterate over all peers in the database ordered by their database id.
+
+    :param batzenca.session.Session session: the session to query, the master session if ``None``
+    :param int batch_size: the number of rows fetched from the database at a time
+
+    :return: an iterator over :class:`batzenca.reports.PeerRow` instances
+    """
+    query = _db_session(session).query(Peer.id, Peer.name).order_by(Peer.id)
+    return _stream(query, PeerRow, batch_size)
+
+
+def releases(mailinglists=None, session=None, batch_size=1000):
+    """Iterate over releases ordered by mailing list and date.
+
+    :param iterable mailinglists: instances of
+        :class:`batzenca.database.mailinglists.MailingList`, if ``None`` releases of all mailing
+        lists are returned
+    :param batzenca.session.Session session: the session to query, the master session if ``None``
+    :param int batch_size: the number of rows fetched from the database at a time
+
+    :return: an iterator over :class:`batzenca.reports.ReleaseRow` instances
+    """
+    query = _db_session(session).query(Release.id, MailingList.name, Release.date, Release.published, Release.previous_release_id)
+    query = query.join(MailingList, Release.mailinglist_id == MailingList.id)
+    if mailinglists is not None:
+        query = query.filter(Release.mailinglist_id.in_([mailinglist.id for mailinglist in mailinglists]))
+    query = query.order_by(MailingList.name, Release.date, Release.id)
+    return _stream(query, ReleaseRow, batch_size)
+
+
+def members(release, active=None, session=None, batch_size=1000):
+    """Iterate over the keys in ``release`` ordered by their database id.
+
+    :param batzenca.database.releases.Release release: the release to report on
+    :param active: if ``True`` only active keys are returned, if ``False`` only inactive keys are
+        returned, if ``None`` all keys are returned
+    :param batzenca.session.Session session: the session to query, the master session if ``None``
+    :param int batch_size: the number of rows fetched from the database at a time
+
+    :return: an iterator over :class:`batzenca.reports.MemberRow` instances
+    """
+    RKA = ReleaseKeyAssociation
+    query = _db_session(session).query(RKA.right_id, Key.id, Key.kid, Key.name, Key.email, RKA.is_active, RKA.policy_exception)
+    query = query.join(Key, RKA.left_id == Key.id).filter(RKA.right_id == release.id)
+    if active is True:
+        query = query.filter(RKA.is_active == True)
+    elif active is False:
+        query = query.filter(RKA.is_active == False)
+    query = query.order_by(Key.id)
+    return _stream(query, MemberRow, batch_size)
+
+
+def sizes(mailinglists=None, session=None, batch_size=1000):
+    """Iterate over releases with the number of their active and inactive keys, ordered by mailing
+    list and date.
+
+    :param iterable mailinglists: instances of
+        :class:`batzenca.database.mailinglists.MailingList`, if ``None`` releases of all mailing
+        lists are returned
+    :param batzenca.session.Session session: the session to query, the master session if ``None``
+    :param int batch_size: the number of rows fetched from the database at a time
+
+    :return: an iterator over :class:`batzenca.reports.SizeRow` instances
+    """
+    RKA = ReleaseKeyAssociation
+    active   = func.coalesce(func.sum(case([(RKA.is_active == True, 1)], else_=0)), 0)
+    inactive = func.coalesce(func.sum(case([(RKA.is_active == False, 1)], else_=0)), 0)
+
+    query = _db_session(session).query(Release.id, MailingList.name, Release.date, active, inactive)
+    query = query.join(MailingList, Release.mailinglist_id == MailingList.id)
+    query = query.outerjoin(RKA, RKA.right_id == Release.id)
+    if mailinglists is not None:
+        query = query.filter(Release.mailinglist_id.in_([mailinglist.id for mailinglist in mailinglists]))
+    query = query.group_by(Release.id, MailingList.name, Release.date)
+    query = query.order_by(MailingList.name, Release.date, Release.id)
+    return _stream(query, SizeRow, batch_size)
+
+
+def history(mailinglists=None, session=None, batch_size=1000):
+    """Iterate over releases with membership statistics, ordered by mailing list and date.
+
+    For each release the number of active and inactive keys is reported as well as the number of
+    keys which are active in this release but were not active in the previous release (``joined``)
+    and the number of keys which were active in the previous release but are not active in this
+    release (``left``). All statistics are computed by a single query.
+
+    :param iterable mailinglists: instances of
+        :class:`batzenca.database.mailinglists.MailingList`, if ``None`` releases of all mailing
+        lists are returned
+    :param batzenca.session.Session session: the session to query, the master session if ``None``
+    :param int batch_size: the number of rows fetched from the database at a time
+
+    :return: an iterator over :class:`batzenca.reports.HistoryRow` instances
+    """
+    RKA  = ReleaseKeyAssociation
+    curr = aliased(RKA)
+    prev = aliased(RKA)
+    db_session = _db_session(session)
+
+    # number of active keys per release, joined against the successor of each release
+    counts = db_session.query(RKA.right_id.label("release_id"), func.count().label("active"))
+    counts = counts.filter(RKA.is_active == True).group_by(RKA.right_id).subquery()
+
+    active   = func.coalesce(func.sum(case([(curr.is_active == True, 1)], else_=0)), 0)
+    inactive = func.coalesce(func.sum(case([(curr.is_active == False, 1)], else_=0)), 0)
+    stayed   = func.coalesce(func.sum(case([(prev.left_id != None, 1)], else_=0)), 0)
+    prev_active = func.coalesce(func.max(counts.c.active), 0)
+
+    query = db_session.query(Release.id, MailingList.name, Release.date,
+                             active, inactive, active - stayed, prev_active - stayed)
+    query = query.join(MailingList, Release.mailinglist_id == MailingList.id)
+    query = query.outerjoin(curr, curr.right_id == Release.id)
+    query = query.outerjoin(prev, and_(prev.right_id == Release.previous_release_id,
+                                       prev.left_id == curr.left_id,
+                                       prev.is_active == True,
+                                       curr.is_active == True))
+    query = query.outerjoin(counts, counts.c.release_id == Release.previous_release_id)
+    if mailinglists is not None:
+        query = query.filter(Release.mailinglist_id.in_([mailinglist.id for mailinglist in mailinglists]))
+    query = query.group_by(Release.id, MailingList.name, Release.date)
+    query = query.order_by(MailingList.name, Release.date, Release.id)
+    return _stream(query, HistoryRow, batch_size)
+
+
+def audit(mailinglists=None, policy=None, rules=None, signed_by=None, date=None, active=True,
+          ignore_exceptions=False, session=None, batch_size=1000):
+    """Iterate over releases with the keys violating a policy, ordered by mailing list and date.
+
+    This answers questions like "which published releases contained keys which violate the
+    tightened policy ``policy`` or which are signed by the compromised key ``signed_by``"::
+
+        >>> for row in reports.audit(policy=tightened, signed_by=compromised):
+        ...     if row.published and any(row.violations.values()):
+        ...         print row.mailinglist, row.date, row.violations
+
+    Each distinct key is evaluated once against each policy it is checked against, see
+    :func:`batzenca.database.policies.Policy.evaluate`, and the outcome is joined back to the
+    releases the key is part of by a single query.
+
+    :param iterable mailinglists: instances of
+        :class:`batzenca.database.mailinglists.MailingList`, if ``None`` releases of all mailing
+        lists are returned
+    :param batzenca.database.policies.Policy policy: the policy to check all keys against, if
+        ``None`` the keys of each release are checked against the policy of that release. The
+        policy need not be stored in the database.
+    :param iterable rules: the rules to check, by default all of
+        :attr:`batzenca.database.policies.Policy.rules`
+    :param batzenca.database.keys.Key signed_by: if not ``None`` keys signed by this key are
+        reported under ``"signed_by"``
+    :param datetime.date date: the date against which key lifespans are checked, by default today
+    :param active: if ``True`` only active keys are checked, if ``None`` all keys are checked
+    :param boolean ignore_exceptions: if ``False`` policy violations of keys with a policy exception
+        in a release are not reported for that release
+    :param batzenca.session.Session session: the session to query, the master session if ``None``
+    :param int batch_size: the number of rows fetched from the database at a time
+
+    :return: an iterator over :class:`batzenca.reports.AuditRow` instances. Their ``violations``
+        entry maps each rule, ``"missing"`` for keys which are not in the GnuPG keyring and
+        ``"signed_by"`` if requested to a tuple of key ids.
+    """
+    if session is None:
+        from batzenca.session import current
+        session = current()
+
+    RKA = ReleaseKeyAssociation
+    db_session = session.db_session
+    rules = Policy.rules if rules is None else tuple(rules)
+
+    def restrict(query):
+        if mailinglists is not None:
+            query = query.filter(Release.mailinglist_id.in_([mailinglist.id for mailinglist in mailinglists]))
+        return query
+
+    membership = and_(RKA.right_id == Release.id, RKA.is_active == True) if active else RKA.right_id == Release.id
+
+    # the distinct (policy, key) pairs to evaluate
+    scope = db_session.query(Release.policy_id.label("policy_id"), RKA.left_id.label("key_id")).join(RKA, membership)
+    scope = restrict(scope).distinct().subquery()
+
+    with session:
+        keys = dict((key.id, key) for key in db_session.query(Key).filter(Key.id.in_(db_session.query(scope.c.key_id))))
+        kids = [key.kid for key in keys.values()]
+        if signed_by is not None:
+            kids.append(signed_by.kid)
+        info = session.gnupg.keys_info(kids, ignore_missing=True)
+        missing = set(key_id for key_id, key in keys.items() if key.kid not in info)
+
+        # (policy id, key id) -> rules violated, the policy id is ``None`` if ``policy`` is given
+        failed = {}
+        if policy is not None:
+            evaluations = [(None, policy, [key for key_id, key in keys.items() if key_id not in missing])]
+        else:
+            pairs = {}
+            for policy_id, key_id in db_session.query(scope.c.policy_id, scope.c.key_id):
+                if key_id not in missing:
+                    pairs.setdefault(policy_id, []).append(keys[key_id])
+            policies = db_session.query(Policy).filter(Policy.id.in_(pairs.keys())) if pairs else []
+            evaluations = [(p.id, p, pairs[p.id]) for p in policies]
+
+        for policy_id, p, policy_keys in evaluations:
+            ids = dict((key.kid, key.id) for key in policy_keys)
+            for result in p.evaluate(policy_keys, rules=rules, date=date).failures():
+                failed.setdefault((policy_id, ids[result.kid]), set()).add(result.rule)
+
+        signed = set()
+        if signed_by is not None and signed_by.kid in info:
+            sign_keys = info[signed_by.kid].sign_keys
+            signed = set(key_id for key_id, key in keys.items()
+                         if key_id not in missing and sign_keys.intersection(info[key.kid].signatures))
+
+    columns = list(rules) + ["missing"] + (["signed_by"] if signed_by is not None else [])
+
+    query = db_session.query(Release.id, MailingList.name, Release.date, Release.published, Release.policy_id,
+                             Key.id, Key.kid, RKA.policy_exception)
+    query = query.join(MailingList, Release.mailinglist_id == MailingList.id)
+    query = query.outerjoin(RKA, membership).outerjoin(Key, RKA.left_id == Key.id)
+    query = restrict(query).order_by(MailingList.name, Release.date, Release.id, Key.id)
+
+    for (release_id, mailinglist, release_date, published), rows in groupby(query.yield_per(batch_size), lambda row: row[:4]):
+        violations = dict((column, []) for column in columns)
+        count = 0
+        for _, _, _, _, policy_id, key_id, kid, policy_exception in rows:
+            if key_id is None:
+                continue
+            count += 1
+            if key_id in missing:
+                violations["missing"].append(kid)
+            if key_id in signed:
+                violations["signed_by"].append(kid)
+            if policy_exception and not ignore_exceptions:
+                continue
+            for rule in failed.get((None if policy is not None else policy_id, key_id), ()):
+                violations[rule].append(kid)
+        yield AuditRow(release_id, mailinglist, release_date, published, count,
+                       dict((column, tuple(kids)) for column, kids in violations.items()))
+
+
+def _current_members(db_session, mailinglists, *columns):
+    """Return a query for ``columns`` over the active keys in the current release of each of
+    ``mailinglists``."""
+    RKA = ReleaseKeyAssociation
+    query = db_session.query(*columns)
+    query = query.join(Release, MailingList.current_release_id == Release.id)
+    query = query.join(RKA, and_(RKA.right_id == Release.id, RKA.is_active == True))
+    query = query.join(Key, RKA.left_id == Key.id)
+    if mailinglists is not None:
+        query = query.filter(MailingList.id.in_([mailinglist.id for mailinglist in mailinglists]))
+    return query
+
+
+def expiring(start=None, end=None, mailinglists=None, session=None, batch_size=1000):
+    """Iterate over the active keys in the current releases of ``mailinglists`` which expire on or
+    after ``start`` and before ``end``, ordered by expiry date.
+
+    The cached :attr:`batzenca.database.keys.Key.expiry_date` is used, GnuPG is not queried. Call
+    :func:`batzenca.database.keys.Key.refresh_all` first if keys were modified directly through
+    ``session.gnupg``. A key which is active on several mailing lists is reported once for each
+    list.
+
+    :param datetime.date start: the first day of the range, if ``None`` already expired keys are
+        included
+    :param datetime.date end: the day after the range, if ``None`` the range is not bounded
+    :param iterable mailinglists: instances of
+        :class:`batzenca.database.mailinglists.MailingList`, if ``None`` all mailing lists are
+        considered
+    :param batzenca.session.Session session: the session to query, the master session if ``None``
+    :param int batch_size: the number of rows fetched from the database at a time
+
+    :return: an iterator over :class:`batzenca.reports.ExpiryRow` instances
+    """
+    query = _current_members(_db_session(session), mailinglists,
+                             MailingList.name, Release.id, Key.id, Key.kid, Key.name, Key.email, Key.expiry_date)
+    query = query.filter(Key.expiry_date != None)
+    if start is not None:
+        query = query.filter(Key.expiry_date >= start)
+    if end is not None:
+        query = query.filter(Key.expiry_date < end)
+    query = query.order_by(Key.expiry_date, MailingList.name, Key.id)
+    return _stream(query, ExpiryRow, batch_size)
+
+
+def expiry_histogram(start=None, weeks=12, mailinglists=None, session=None, batch_size=1000):
+    """Iterate over the number of active keys in the current release of each mailing list which
+    expire in each of the ``weeks`` weeks starting at ``start``, ordered by mailing list and week.
+
+    All counts are computed from a single range query over the cached
+    :attr:`batzenca.database.keys.Key.expiry_date`.
+
+    :param datetime.date start: the first day of the first week, by default today
+    :param int weeks: the number of weeks
+    :param iterable mailinglists: instances of
+        :class:`batzenca.database.mailinglists.MailingList`, if ``None`` all mailing lists are
+        considered
+    :param batzenca.session.Session session: the session to query, the master session if ``None``
+    :param int batch_size: the number of rows fetched from the database at a time
+
+    :return: an iterator over :class:`batzenca.reports.ExpiryHistogramRow` instances
+    """
+    if start is None:
+        start = datetime.date.today()
+    end = start + datetime.timedelta(weeks=weeks)
+
+    db_session = _db_session(session)
+    names = db_session.query(MailingList.name).filter(MailingList.current_release_id != None)
+    if mailinglists is not None:
+        names = names.filter(MailingList.id.in_([mailinglist.id for mailinglist in mailinglists]))
+
+    counts = {}
+    for row in expiring(start, end, mailinglists, session, batch_size):
+        week = (row.expiry_date - start).days // 7
+        counts[(row.mailinglist, week)] = counts.get((row.mailinglist, week), 0) + 1
+
+    for (name,) in names.order_by(MailingList.name):
+        for week in range(weeks):
+            yield ExpiryHistogramRow(name, start + datetime.timedelta(weeks=week), counts.get((name, week), 0))
+
+
+def expiry_forecast(days=30, date=None, mailinglists=None, session=None, batch_size=1000):
+    """Iterate over mailing lists with the number of active keys in their current release which have
+    expired before ``date`` and which expire within ``days`` days of ``date``, ordered by mailing
+    list.
+
+    All statistics are computed by a single query over the cached
+    :attr:`batzenca.database.keys.Key.expiry_date`, GnuPG is not queried. This is cheap enough to
+    run daily for all lists, see :func:`batzenca.reports.expiring` on keeping the cache current.
+
+    :param int days: the length of the forecast period in days
+    :param datetime.date date: the first day of the forecast period, by default today
+    :param iterable mailinglists: instances of
+        :class:`batzenca.database.mailinglists.MailingList`, if ``None`` all mailing lists are
+        considered
+    :param batzenca.session.Session session: the session to query, the master session if ``None``
+    :param int batch_size: the number of rows fetched from the database at a time
+
+    :return: an iterator over :class:`batzenca.reports.ExpiryForecastRow` instances
+    """
+    if date is None:
+        date = datetime.date.today()
+    end = date + datetime.timedelta(days=days)
+
+    expired_count  = func.coalesce(func.sum(case([(Key.expiry_date < date, 1)], else_=0)), 0)
+    expiring_count = func.coalesce(func.sum(case([(and_(Key.expiry_date >= date, Key.expiry_date < end), 1)], else_=0)), 0)
+    next_expiry = func.min(case([(Key.expiry_date >= date, Key.expiry_date)]))
+
+    query = _current_members(_db_session(session), mailinglists, MailingList.name, func.count(Key.id), expired_count, expiring_count, next_expiry)
+    query = query.group_by(MailingList.name).order_by(MailingList.name)
+    return _stream(query, ExpiryForecastRow, batch_size)
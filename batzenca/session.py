@@ -1,21 +1,76 @@
-from database.base import Base
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
 import os
-import git
+import threading
+from contextlib import contextmanager
+
+from database.base import ReadOnlyError
 
 
 class Session:
+    """The GnuPG keyring, the database and the git repository in the directory ``path``.
+
+    Each backend is set up on first use, i.e. creating a session is cheap and neither touches
+    ``path`` nor imports GnuPG or git bindings.
+
+    Several sessions may be used in one process. All functions of this library work with the
+    current session, see :func:`batzenca.session.current`. A session is made current for the calling
+    thread inside a ``with`` block::
+
+        >>> with Session("/path/to/ca"):
+        ...     MailingList.from_name("rebels").current_release.verify()
+
+    A session opened with ``readonly=True`` never writes to ``path``: the database is opened
+    read-only and is not created or upgraded, flushing changes, snapshots and modifying the GnuPG
+    keyring raise a :class:`batzenca.database.base.ReadOnlyError`. This is meant for reporting jobs
+    which run next to a session which modifies the same directory.
+
+    :param str path: the directory holding all data
+    :param bool readonly: open all backends read-only
+    :param bool expire_on_commit: if ``True`` all objects are expired on commit and reloaded on next
+        access, see also :func:`batzenca.session.Session.bulk`
+    :param str url: a database URL, if ``None`` the database is configured in ``path/batzenca.cfg``,
+        see :attr:`batzenca.session.Session.db_url`
+    """
 
     _gitignore = """.gitignore
+batzenca.db-wal
+batzenca.db-shm
 gnupg/pubring.gpg~
 gnupg/random_seed
 releases
 """
 
-    def __init__(self, path):
+    #: pragmas applied to each SQLite connection: write-ahead logging lets readers proceed while a
+    #: writer holds the database, writers wait up to ``busy_timeout`` milliseconds for each other
+    sqlite_pragmas = (("journal_mode", "WAL"),
+                      ("synchronous",  "NORMAL"),
+                      ("cache_size",   -16000),
+                      ("busy_timeout", 5000))
+
+    #: pragmas applied to each SQLite connection of a read-only session
+    sqlite_readonly_pragmas = (("query_only",   "ON"),
+                               ("cache_size",   -16000),
+                               ("busy_timeout", 5000))
+
+    def __init__(self, path, readonly=False, expire_on_commit=True, url=None):
         self.path = path
+        self._db_url = url
+        self.readonly = readonly
+        self.expire_on_commit = expire_on_commit
+        # objects cache query results until the next commit or rollback
+        self.db_generation = 0
+        self._lock = threading.RLock()
+        self._gnupg = None
+        self._db_engine = None
+        self._db_session = None
+        self._repo = None
+
+    def _create_directories(self):
+        path = self.path
+        if self.readonly:
+            if not os.path.isdir(path):
+                raise IOError("Configuration directory '%s' does not exist."%path)
+            return
+
         if not os.path.exists(path):
             os.mkdir(path)
             os.chmod(path, 0700)
@@ -29,31 +84,160 @@ releases
 
         if not os.path.isdir(self.release_dump_path):
             raise IOError("Cannot create directory '%' because a file with the same name exists already."%self.release_dump_path)
-            
-        self.db_engine = create_engine('sqlite:///%s/batzenca.db'%path, echo=False)
 
-        Base.metadata.create_all(self.db_engine)
+    @property
+    def gnupg(self):
+        """The :class:`batzenca.gnupg.GnuPG` instance for the keyring in ``path/gnupg``."""
+        if self._gnupg is None:
+            with self._lock:
+                if self._gnupg is None:
+                    self._create_directories()
+                    from gnupg import GnuPG
+                    self._gnupg = GnuPG(self.path + os.path.sep + "gnupg", readonly=self.readonly)
+        return self._gnupg
 
-        self.db_session =  sessionmaker(bind=self.db_engine)()
-        self.db_session.commit()
+    @property
+    def db_url(self):
+        """The database URL: the ``url`` passed to the constructor, the ``url`` option in the
+        ``[database]`` section of ``path/batzenca.cfg`` or the SQLite database
+        ``path/batzenca.db``.
+
+        It is assumed that batzenca.cfg has the following form, all options are optional and the
+        pool options are ignored for SQLite databases::
+
+            [database]
+            url: postgresql://localhost/batzenca
+            pool_size: 5
+            max_overflow: 10
+            pool_timeout: 30
+            pool_recycle: 3600
+            isolation_level: READ COMMITTED
+
+        """
+        if self._db_url is not None:
+            return self._db_url
+        url = self._database_config().get("url")
+        if url:
+            return url
+        return 'sqlite:///%s'%os.path.join(self.path, "batzenca.db")
+
+    def _database_config(self):
+        """Return the options in the ``[database]`` section of ``path/batzenca.cfg`` as a dict."""
+        import ConfigParser
+        config = ConfigParser.SafeConfigParser()
+        config.read(os.path.join(self.path, "batzenca.cfg"))
+        if not config.has_section("database"):
+            return {}
+        return dict(config.items("database"))
 
-        from gnupg import GnuPG
-        self.gnupg = GnuPG(path + os.path.sep + "gnupg")
+    @property
+    def db_engine(self):
+        """The SQLAlchemy engine for :attr:`batzenca.session.Session.db_url`, the schema is upgraded
+        to the most recent version on first use unless this session is read-only."""
+        if self._db_engine is None:
+            with self._lock:
+                if self._db_engine is None:
+                    from database.migrations import upgrade, current_version, head
+                    from sqlalchemy import create_engine, event
+                    from sqlalchemy.engine.url import make_url
+
+                    self._create_directories()
+
+                    config = self._database_config()
+                    url = make_url(self.db_url)
+                    kwds = {"echo": False}
+                    if config.get("isolation_level"):
+                        kwds["isolation_level"] = config["isolation_level"]
+
+                    if url.get_backend_name() == "sqlite":
+                        filename = url.database
+                        if self.readonly:
+                            if not filename or not os.path.exists(filename):
+                                raise IOError("Database '%s' does not exist."%filename)
+                            # Python 2 cannot open URI filenames with mode=ro, the query_only
+                            # pragma refuses writes instead
+                        kwds["connect_args"] = {"check_same_thread": False}
+                    else:
+                        for option in ("pool_size", "max_overflow", "pool_timeout", "pool_recycle"):
+                            if config.get(option):
+                                kwds[option] = int(config[option])
+                        kwds["pool_pre_ping"] = True
+
+                    db_engine = create_engine(url, **kwds)
+                    if db_engine.dialect.name == "sqlite":
+                        event.listen(db_engine, "connect", self._set_sqlite_pragmas)
+                    elif self.readonly and db_engine.dialect.name == "postgresql":
+                        event.listen(db_engine, "connect", self._set_postgresql_readonly)
+
+                    if self.readonly:
+                        version = current_version(db_engine)
+                        if version != head():
+                            raise RuntimeError("The database has schema version %d but version %d is required, open it once without readonly=True to upgrade it."%(version, head()))
+                    else:
+                        # other threads must not see the engine before its schema is upgraded
+                        try:
+                            upgrade(db_engine, session=self,
+                                    snapshot=lambda version: self._snapshot_before_migration(db_engine, version))
+                        except Exception:
+                            db_engine.dispose()
+                            raise
+                    self._db_engine = db_engine
+        return self._db_engine
+
+    @property
+    def db_session(self):
+        """The database session of the calling thread, each thread works with its own session."""
+        if self._db_session is None:
+            with self._lock:
+                if self._db_session is None:
+                    from sqlalchemy import event
+                    from sqlalchemy.orm import sessionmaker, scoped_session
+
+                    factory = sessionmaker(bind=self.db_engine, expire_on_commit=self.expire_on_commit)
+                    event.listen(factory, "after_commit", self._next_generation)
+                    event.listen(factory, "after_soft_rollback", self._next_generation)
+                    if self.readonly:
+                        event.listen(factory, "before_flush", self._refuse_flush)
+                    self._db_session = scoped_session(factory)
+        return self._db_session
 
+    @property
+    def repo(self):
+        """The git repository in ``path`` used for snapshots, it is created on first use."""
+        if self._repo is None:
+            with self._lock:
+                if self._repo is None:
+                    self._repo = self._open_repo()
+        return self._repo
+
+    def _open_repo(self):
+        import git
         try:
-            git.Repo(self.path)
+            return git.Repo(self.path)
         except git.InvalidGitRepositoryError:
+            if self.readonly:
+                raise
+            self._create_directories()
             repo = git.Repo.init(self.path)
             # git ignore
             open(os.path.join(repo.working_dir, ".gitignore"), "w").write(Session._gitignore)
             # add useful files
-            repo.git.add("batzenca.db")
+            if os.path.exists(os.path.join(repo.working_dir, "batzenca.db")):
+                repo.git.add("batzenca.db")
             for filename in ("pubring.gpg", "secring.gpg", "trustdb.gpg"):
                 fullpath = os.path.join(repo.working_dir, "gnupg", filename)
                 if os.path.exists(fullpath):
                     repo.git.add(fullpath)
-            repo.git.commit(m="initial commit")
-            
+            repo.git.commit(m="initial commit", allow_empty=True)
+            return repo
+
+    def __enter__(self):
+        _bound.__dict__.setdefault("stack", []).append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _bound.stack.pop()
+
     def commit(self, snapshot=False, *args, **kwds):
         self.db_session.commit()
         if snapshot:
@@ -63,23 +247,118 @@ releases
     def query(self):
         return self.db_session.query
 
-    @property
-    def add(self):
-        return self.db_session.add
+    def add(self, instance):
+        """Add ``instance`` to the database session of the calling thread."""
+        self.db_session.add(instance)
+        self._added(1)
 
-    @property
-    def add_all(self):
-        return self.db_session.add_all
+    def add_all(self, instances):
+        """Add all ``instances`` to the database session of the calling thread."""
+        instances = list(instances)
+        self.db_session.add_all(instances)
+        self._added(len(instances))
+
+    def _added(self, count):
+        db_session = self.db_session()
+        batch_size = db_session.info.get("bulk_batch_size")
+        if batch_size is None:
+            return
+        db_session.info["bulk_pending"] = db_session.info.get("bulk_pending", 0) + count
+        if db_session.info["bulk_pending"] >= batch_size:
+            db_session.flush()
+            db_session.info["bulk_pending"] = 0
+
+    @contextmanager
+    def bulk(self, batch_size=1000, expire_on_commit=False):
+        """Run a ``with`` block as a bulk operation on the database session of the calling thread.
+
+        Inside the block queries do not flush pending objects first, objects added by
+        :func:`batzenca.session.Session.add` or :func:`batzenca.session.Session.add_all` are
+        flushed in batches of ``batch_size`` instead. Commits inside the block do not expire loaded
+        objects unless ``expire_on_commit`` is ``True``. Remaining pending objects are flushed when
+        the block is left, committing is left to the caller::
+
+            >>> with session.bulk():
+            ...     for keyid in keyids:
+            ...         session.add(Key(keyid))
+            >>> session.commit()
+
+        .. note::
+
+           As autoflush is disabled, queries inside the block do not see objects which were added
+           since the last batch was flushed. Call ``session.db_session.flush()`` where this matters.
+
+        :param int batch_size: the number of added objects after which pending objects are flushed
+        :param bool expire_on_commit: expire all objects on commit inside the block
+
+        """
+        db_session = self.db_session()
+        saved = (db_session.autoflush, db_session.expire_on_commit, db_session.info.get("bulk_batch_size"))
+
+        db_session.autoflush = False
+        db_session.expire_on_commit = expire_on_commit
+        db_session.info["bulk_batch_size"] = batch_size
+        db_session.info["bulk_pending"] = 0
+        try:
+            yield self
+            db_session.flush()
+        finally:
+            db_session.autoflush, db_session.expire_on_commit, batch_size = saved
+            if batch_size is None:
+                db_session.info.pop("bulk_batch_size", None)
+            else:
+                db_session.info["bulk_batch_size"] = batch_size
+            db_session.info.pop("bulk_pending", None)
+
+    def remove(self):
+        """Close the database session of the calling thread.
+
+        Worker threads should call this function when they are done, the next access from the same
+        thread starts a fresh database session.
+        """
+        self.db_session.remove()
 
     @property
     def release_dump_path(self):
         """Path for storing releases in .asc and .yaml format."""
         return os.path.join(self.path, "releases")
 
+    def _next_generation(self, *args):
+        self.db_generation += 1
+
+    def _set_sqlite_pragmas(self, dbapi_connection, connection_record):
+        pragmas = self.sqlite_readonly_pragmas if self.readonly else self.sqlite_pragmas
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute("PRAGMA %s = %s"%(name, value))
+        cursor.close()
+
+    def _set_postgresql_readonly(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+        cursor.close()
+
+    def _refuse_flush(self, db_session, flush_context, instances):
+        raise ReadOnlyError("The session for '%s' was opened read-only."%self.path)
+
+    def _snapshot_before_migration(self, db_engine, version):
+        self._snapshot(db_engine, msg="snapshot before migrating database schema to version %d"%version)
+
     def snapshot(self, verbose=False, msg="snapshot"):
-        repo = git.Repo(self.path)
-        repo.git.add("batzenca.db")
-        repo.git.add("gnupg")
+        if self.readonly:
+            raise ReadOnlyError("The session for '%s' was opened read-only."%self.path)
+        self._snapshot(self.db_engine, verbose=verbose, msg=msg)
+
+    def _snapshot(self, db_engine, verbose=False, msg="snapshot"):
+        repo = self.repo
+        # only an SQLite database inside the directory is part of the snapshot
+        filename = os.path.abspath(os.path.join(self.path, "batzenca.db"))
+        if db_engine.dialect.name == "sqlite" and os.path.abspath(db_engine.url.database or "") == filename:
+            # move committed transactions from the write-ahead log into the database file
+            db_engine.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            repo.git.add("batzenca.db")
+        if os.path.exists(os.path.join(self.path, "gnupg")):
+            repo.git.add("gnupg")
         if verbose:
             print repo.git.status()
         if repo.is_dirty():
@@ -87,6 +366,58 @@ releases
             if verbose:
                 print out
         
+
+
+class _SessionProxy(object):
+    """Forward all attribute access to the current session."""
+
+    def __getattr__(self, name):
+        return getattr(current(), name)
+
+    def __setattr__(self, name, value):
+        setattr(current(), name, value)
+
+    def __repr__(self):
+        return "<current session: %s>"%current().path
+
+
+def current():
+    """Return the session bound to the calling thread by the innermost ``with`` block or, outside
+    of any such block, the process wide default session.
+
+    The default session uses the directory ``$BATZENCADIR`` and can be replaced by calling
+    :func:`batzenca.session.bind`.
+    """
+    stack = getattr(_bound, "stack", None)
+    if stack:
+        return stack[-1]
+    return _default[0]
+
+
+def bind(session):
+    """Make ``session`` the process wide default session.
+
+    :param batzenca.session.Session session: the new default session
+    :return: the previous default session
+    """
+    previous, _default[0] = _default[0], session
+    return previous
+
+
+def _bind_worker(session):
+    """Make ``session`` current in a forked worker process.
+
+    Workers inherit the sessions of the ``with`` blocks of the thread which forked them, these are
+    discarded as well.
+    """
+    bind(session)
+    _bound.stack = [session]
+
+
 BATZENCADIR  = os.environ.get("BATZENCADIR", os.path.expanduser("~") + os.path.sep + ".batzenca")
-session = Session(BATZENCADIR)
 
+_bound   = threading.local()
+_default = [Session(BATZENCADIR)]
+
+#: the current session, attribute access is forwarded to :func:`batzenca.session.current`
+session = _SessionProxy()
@@ -7,6 +7,15 @@ Various utility functions.
 """
 
 import sys
+from collections import namedtuple
+
+#: a key in the GnuPG database without an entry in the database, see
+#: :func:`batzenca.util.find_orphaned_keys`
+Orphan = namedtuple("Orphan", ("fingerprint", "uid", "created"))
+
+#: the seconds spent publishing a mailing list, see :func:`batzenca.util.publish`: rendering its
+#: messages, waiting for them to be encrypted after rendering all lists, and sending them
+PublishTiming = namedtuple("PublishTiming", ("prepare", "encrypt", "send"))
 
 
 def thunderbird_rules(release, mime_encode=False, mime_filename=None):
@@ -99,17 +108,20 @@ def plot_nkeys(mailinglists, active_only=True):
     """
     import matplotlib.dates as mdates
     import matplotlib.pyplot as plt
+    from itertools import groupby
+    from batzenca import reports
 
     plt.clf()
     plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m/%d/%Y'))
-    for mailinglist in mailinglists:
-        x = [release.date for release in mailinglist.releases]
+    for name, rows in groupby(reports.history(mailinglists), lambda row: row.mailinglist):
+        rows = list(rows)
+        x = [row.date for row in rows]
         if active_only:
-            y = [len(release.active_keys) for release in mailinglist.releases]
+            y = [row.active for row in rows]
         else:
-            y = [len(release.keys) for release in mailinglist.releases]
+            y = [row.active + row.inactive for row in rows]
 
-        plt.plot(x, y, linewidth=2.5, alpha=0.9, marker='o', label=mailinglist.name)
+        plt.plot(x, y, linewidth=2.5, alpha=0.9, marker='o', label=name)
 
     plt.legend(loc='upper left')
     plt.gcf().set_size_inches(20, 5)
@@ -122,23 +134,113 @@ def find_orphaned_keys():
 
     This library uses two databases: the GnuPG database of keys and the database storing
     metainformation which the user mostly works with. This function returns those keys in the GnuPG
-    database which do not have an entry in the user facing database.
+    database which do not have an entry in the user facing database. A key is considered known if
+    any of its subkey ids matches a key id in the database.
+
+    :return: a tuple of :class:`batzenca.util.Orphan` records
     """
-    from batzenca import EntryNotFound, Key, session
+    import datetime
+    from batzenca import Key, session
+
+    known = set(keyid for (keyid,) in session.db_session.query(Key.keyid))
+
     orphans = []
     for key in session.gnupg.ctx.op_keylist_all(None, 0):
-        dbkey = None
-        for sk in key.subkeys:
-            try:
-                dbkey = Key.from_keyid(int(sk.keyid,16))
-                break
-            except EntryNotFound:
-                pass
-        if dbkey is None:
-            orphans.append(Key(int(key.subkeys[0].keyid,16)))
+        if any(Key.keyid_to_int(subkey.keyid) in known for subkey in key.subkeys):
+            continue
+        uid = unicode(key.uids[0].uid, 'utf-8') if key.uids else None
+        created = datetime.date.fromtimestamp(min(subkey.timestamp for subkey in key.subkeys))
+        orphans.append(Orphan(key.subkeys[0].fpr, uid, created))
     return tuple(orphans)
 
 
+def _verify_init(path, url):
+    """Bind a read-only session for ``path`` in a worker process of
+    :func:`batzenca.util.verify_all` and list its keyring once, so that shards find all keys in
+    the cache."""
+    from batzenca.session import Session, _bind_worker
+    session = Session(path, readonly=True, url=url)
+    _bind_worker(session)
+    session.gnupg.keys_cache_all()
+
+
+def _verify_shard(task):
+    """Evaluate the policy of a release for some of its keys, see
+    :func:`batzenca.util.verify_all`."""
+    from batzenca import Key, Release, session
+
+    release_id, kids, exceptions, date = task
+    release = session.query(Release).get(release_id)
+    keys = dict((key.kid, key) for key in session.query(Key).filter(Key.kid.in_(kids)))
+    keys = [keys[kid] for kid in kids]
+    return release.policy.evaluate(keys, exceptions=[key for key in keys if key.kid in exceptions], date=date)
+
+
+def verify_all(mailinglists=None, jobs=None, shard_size=500, ignore_exceptions=False, warn=True):
+    """Verify the current releases of all ``mailinglists`` in parallel.
+
+    The active keys of each release are split into shards of at most ``shard_size`` keys. Shards
+    are evaluated by ``jobs`` worker processes, each with its own read-only session and GnuPG
+    context, and the reports of all shards of a release are merged.
+
+    :param iterable mailinglists: a list of mailing lists to consider or ``None`` for all.
+    :param int jobs: the number of worker processes, by default the number of CPUs. If ``1``, all
+        shards are evaluated in this process.
+    :param int shard_size: the maximal number of keys evaluated in one piece
+    :param boolean ignore_exceptions: see :func:`batzenca.database.releases.Release.verify`
+    :param boolean warn: if ``True`` a :class:`batzenca.database.policies.PolicyViolation`
+        warning is issued for every failure.
+
+    :return: an ordered dictionary mapping mailing lists to
+        :class:`batzenca.database.policies.PolicyReport` objects
+
+    .. note::
+
+       Worker processes read the database and the GnuPG keyring from disk, so they do not see
+       changes which were not committed.
+    """
+    import datetime
+    import multiprocessing
+    from collections import OrderedDict
+    from batzenca import MailingList, session
+
+    if mailinglists is None:
+        mailinglists = MailingList.all()
+    mailinglists = list(mailinglists)
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    date = datetime.date.today()
+    tasks, shards = [], []
+    for i, mailinglist in enumerate(mailinglists):
+        release = mailinglist.current_release
+        release.load("verify")
+        active = [assoc for assoc in release.key_associations if assoc.is_active]
+        exceptions = frozenset() if ignore_exceptions else frozenset(assoc.key.kid for assoc in active if assoc.policy_exception)
+        kids = [assoc.key.kid for assoc in active]
+        for j in range(0, max(len(kids), 1), shard_size):
+            tasks.append((release.id, kids[j:j+shard_size], exceptions, date))
+            shards.append(i)
+
+    if jobs == 1:
+        results = map(_verify_shard, tasks)
+    else:
+        pool = multiprocessing.Pool(jobs, initializer=_verify_init, initargs=(session.path, session.db_url))
+        try:
+            results = pool.map(_verify_shard, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    reports = OrderedDict()
+    for i, mailinglist in enumerate(mailinglists):
+        report = [result for shard, result in zip(shards, results) if shard == i]
+        reports[mailinglist] = report[0].merge(*report[1:])
+        if warn:
+            reports[mailinglist].warn()
+    return reports
+
+
 def import_new_key(key, peer=None, mailinglists=None, force=False):
     """Import a new ``key`` for ``peer``.
 
@@ -270,59 +372,81 @@ def smtpserverize(email):
     return smtpserver
 
 
-def publish(mailinglists=None, debug=False, msg="", attach=[]):
+def publish(mailinglists=None, debug=False, msg="", attach=[], jobs=1):
     """Publish all outstanding releases.
 
+    Publishing happens in two stages. First, the releases of all lists are prepared one after
+    another, see :func:`batzenca.database.releases.Release.prepare`. Their messages are signed and
+    encrypted by ``jobs`` worker processes while the next list is rendered. Second, the messages are
+    sent list by list in order, and all changes are committed once every list has been published.
+
     :param iterable mailinglists: a list of mailing lists to consider or ``None`` for all.
     :param boolean debug: do not send e-mail to lists but to CA e-mail address.
     :param string msg: message to be included in git commit
     :param list attach: each function in ``attach`` will be called on ``release`` with parameter
         ``mime_encode=True`` and the output attached to the release.
+    :param int jobs: the number of processes signing and encrypting messages, see
+        :class:`batzenca.pgpmime.PGPMIMEPool`
+
+    :return: an ordered dictionary mapping the names of published mailing lists to
+        :class:`batzenca.util.PublishTiming` records
     """
+    import time
+    from collections import OrderedDict
     from batzenca import MailingList, session
+    from batzenca.pgpmime import PGPMIMEPool
 
     if mailinglists is None:
         mailinglists = MailingList.all()
 
-    published_releases = []
+    timings = OrderedDict()
     smtpservers = {}
 
-    for i, mailinglist in enumerate(mailinglists):
-        print "%3d. [%s]"%(i, mailinglist),
-        release = mailinglist.current_release
+    with PGPMIMEPool(jobs) as pool:
+        prepared = []
+        for mailinglist in mailinglists:
+            release = mailinglist.current_release
+            if release.published:
+                continue
 
-        if release.published:
-            print
-            continue
+            start = time.time()
+            attachments = tuple(attach_fn(release, mime_encode=True) for attach_fn in attach)
+            prepared.append((mailinglist, release.prepare(debug=debug, attachments=attachments, pool=pool), time.time() - start))
 
-        attachments = []
-        for attach_fn in attach:
-            attachments.append(attach_fn(release, mime_encode=True))
+        for i, (mailinglist, messages, prepare_time) in enumerate(prepared):
+            print "%3d. [%s]"%(i, mailinglist),
+            sys.stdout.flush()
 
-        attachments = tuple(attachments)
+            start = time.time()
+            messages.wait()
+            wait_time = time.time() - start
 
-        email = release.policy.ca.email
+            email = messages.release.policy.ca.email
 
-        if email in smtpservers:
-            smtpserver = smtpservers[email]
-        else:
-            smtpserver = smtpserverize(email)
-            smtpservers[email] = smtpserver
+            if email in smtpservers:
+                smtpserver = smtpservers[email]
+            else:
+                smtpserver = smtpserverize(email)
+                smtpservers[email] = smtpserver
 
-        release.send(smtpserver, debug=debug, attachments=attachments)
+            start = time.time()
+            messages.release.send(smtpserver, prepared=messages)
+            send_time = time.time() - start
 
-        published_releases.append(mailinglist.name)
+            timings[mailinglist.name] = PublishTiming(prepare_time, wait_time, send_time)
 
-        print "published"
-        sys.stdout.flush()
+            print "published (prepare: %.1fs, encrypt: %.1fs, send: %.1fs)"%timings[mailinglist.name]
+            sys.stdout.flush()
 
     for smtpserver in smtpservers.itervalues():
         smtpserver.quit()
 
     if not debug:
-        msg = msg + " " + ", ".join(published_releases)
+        msg = msg + " " + ", ".join(timings)
         session.commit(verbose=True, snapshot=True, msg=msg)
 
+    return timings
+
 
 def new_ca_key(new_key, old_key):
     """Switch CA key from ``old_key`` to ``new_key`` in all mailing lists with a policy matching
@@ -0,0 +1,15 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Copy the database of the current session into the empty database at the URL given as the first
+argument, e.g. postgresql://localhost/batzenca
+"""
+import sys
+from batzenca import session
+from batzenca.database.transfer import copy_database
+
+if len(sys.argv) != 2:
+    sys.exit("usage: %s URL"%sys.argv[0])
+
+for table, count in sorted(copy_database(session.db_engine, sys.argv[1]).items()):
+    print "%-24s %6d rows"%(table, count)
@@ -4,7 +4,7 @@ setup(
     name = 'BatzenCA',
     version = '0.1',
     packages = ['batzenca', 'batzenca/database'],
-    scripts = ['scripts/batzenca-interactive.py', 'scripts/batzenca-release.py'],
+    scripts = ['scripts/batzenca-interactive.py', 'scripts/batzenca-release.py', 'scripts/batzenca-copy-database.py'],
     license = 'Simplified BSD License',
     long_description=open('README.rst').read(),
     author = 'Martin R. Albrecht',
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+"""
+Databases created by earlier versions are upgraded in place.
+"""
+
+import batzenca
+import batzenca.database.migrations as migrations
+import batzenca.database.transfer as transfer
+import sqlalchemy
+import unittest
+
+# the schema as created by BatzenCA 0.1
+LEGACY_SCHEMA = (
+    """CREATE TABLE peers (id INTEGER NOT NULL, name VARCHAR NOT NULL, data0 VARCHAR, data1 VARCHAR,
+                           data2 VARCHAR, data3 VARCHAR, PRIMARY KEY (id))""",
+    """CREATE TABLE keys (id INTEGER NOT NULL, kid VARCHAR NOT NULL, name VARCHAR, email VARCHAR,
+                          timestamp DATE, peer_id INTEGER, PRIMARY KEY (id), UNIQUE (kid),
+                          FOREIGN KEY(peer_id) REFERENCES peers (id))""",
+    """CREATE TABLE policies (id INTEGER NOT NULL, name VARCHAR, implementation_date DATE,
+                              ca_id INTEGER NOT NULL, key_len INTEGER, key_lifespan INTEGER,
+                              algorithms_str VARCHAR, dead_man_switch BOOLEAN, description TEXT,
+                              PRIMARY KEY (id), FOREIGN KEY(ca_id) REFERENCES keys (id))""",
+    """CREATE TABLE mailinglists (id INTEGER NOT NULL, name VARCHAR NOT NULL, email VARCHAR,
+                                  description TEXT, new_member_msg TEXT, key_update_msg TEXT,
+                                  key_expiry_warning_msg TEXT, dead_man_switch_msg TEXT,
+                                  policy_id INTEGER, active BOOLEAN, PRIMARY KEY (id), UNIQUE (name),
+                                  FOREIGN KEY(policy_id) REFERENCES policies (id))""",
+    """CREATE TABLE releases (id INTEGER NOT NULL, mailinglist_id INTEGER, date DATE,
+                              published BOOLEAN, policy_id INTEGER, PRIMARY KEY (id),
+                              FOREIGN KEY(mailinglist_id) REFERENCES mailinglists (id),
+                              FOREIGN KEY(policy_id) REFERENCES policies (id))""",
+    """CREATE TABLE releasekeyassociations (left_id INTEGER NOT NULL, right_id INTEGER NOT NULL,
+                                            policy_exception BOOLEAN, is_active BOOLEAN,
+                                            PRIMARY KEY (left_id, right_id),
+                                            FOREIGN KEY(left_id) REFERENCES keys (id),
+                                            FOREIGN KEY(right_id) REFERENCES releases (id))""",
+)
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine("sqlite://")
+
+    def index_names(self, table_name):
+        return set(index['name'] for index in sqlalchemy.inspect(self.engine).get_indexes(table_name))
+
+    def test_fresh_database(self):
+        applied = migrations.upgrade(self.engine)
+        self.assertEqual(applied, tuple())
+        self.assertEqual(migrations.current_version(self.engine), migrations.head())
+        self.assertIn("ix_keys_email", self.index_names("keys"))
+
+    def test_legacy_database(self):
+        for statement in LEGACY_SCHEMA:
+            self.engine.execute(statement)
+        self.assertEqual(migrations.current_version(self.engine), 0)
+
+        for mailinglist_id in (1, 2):
+            self.engine.execute("INSERT INTO mailinglists (id, name) VALUES (%d, 'list%d')"%(mailinglist_id, mailinglist_id))
+        for release_id, mailinglist_id, date in ((1, 1, '2014-01-01'), (2, 2, '2014-01-01'),
+                                                 (3, 1, '2014-03-01'), (4, 1, '2014-02-01')):
+            self.engine.execute("INSERT INTO releases (id, mailinglist_id, date) VALUES (%d, %d, '%s')"%(release_id, mailinglist_id, date))
+
+        self.engine.execute("INSERT INTO keys (id, kid) VALUES (1, '0x4e2584fc19840e5f')")
+        self.engine.execute("INSERT INTO keys (id, kid) VALUES (2, '0xe843c898ab0fa2fd')")
+
+        snapshots = []
+        applied = migrations.upgrade(self.engine, snapshot=snapshots.append)
+
+        self.assertEqual(applied, tuple(range(1, migrations.head()+1)))
+        self.assertEqual(snapshots, [migrations.head()])
+        self.assertEqual(migrations.current_version(self.engine), migrations.head())
+
+        self.assertTrue(set(["ix_keys_email", "ix_keys_name", "ix_keys_peer_id"]).issubset(self.index_names("keys")))
+        self.assertIn("ix_peers_name", self.index_names("peers"))
+        self.assertIn("ix_releases_mailinglist_id_date", self.index_names("releases"))
+        self.assertIn("ix_releasekeyassociations_right_id_is_active", self.index_names("releasekeyassociations"))
+
+        links = dict(self.engine.execute("SELECT id, previous_release_id FROM releases").fetchall())
+        self.assertEqual(links, {1: None, 2: None, 3: 4, 4: 1})
+        current = dict(self.engine.execute("SELECT id, current_release_id FROM mailinglists").fetchall())
+        self.assertEqual(current, {1: 3, 2: 2})
+
+        self.assertTrue(set(["ix_keys_keyid", "ix_keys_fpr"]).issubset(self.index_names("keys")))
+        keyids = dict(self.engine.execute("SELECT id, keyid FROM keys").fetchall())
+        self.assertEqual(keyids, {1: 0x4e2584fc19840e5f, 2: 0xe843c898ab0fa2fd - (1<<64)})
+        self.assertIn("ix_keys_expiry_date", self.index_names("keys"))
+
+        # nothing left to do
+        self.assertEqual(migrations.upgrade(self.engine, snapshot=snapshots.append), tuple())
+        self.assertEqual(len(snapshots), 1)
+
+    def test_failing_step(self):
+        migrations.upgrade(self.engine)
+        version = migrations.head()
+
+        def step(connection, session):
+            connection.execute("ALTER TABLE peers ADD COLUMN nickname VARCHAR")
+            raise RuntimeError("step failed")
+
+        migrations.MIGRATIONS.append((version+1, "failing step", step))
+        try:
+            self.assertRaises(RuntimeError, migrations.upgrade, self.engine)
+        finally:
+            migrations.MIGRATIONS.pop()
+
+        # the step and its version are rolled back together
+        self.assertEqual(migrations.current_version(self.engine), version)
+        columns = [column['name'] for column in sqlalchemy.inspect(self.engine).get_columns("peers")]
+        self.assertNotIn("nickname", columns)
+
+    def test_copy_database(self):
+        migrations.upgrade(self.engine)
+        self.engine.execute("INSERT INTO mailinglists (id, name, current_release_id) VALUES (1, 'list', 1)")
+        # release 1 succeeds release 2, i.e. rows reference rows which are copied later
+        self.engine.execute("INSERT INTO releases (id, mailinglist_id, date, previous_release_id) VALUES (1, 1, '2014-02-01', 2)")
+        self.engine.execute("INSERT INTO releases (id, mailinglist_id, date, previous_release_id) VALUES (2, 1, '2014-01-01', NULL)")
+        self.engine.execute("INSERT INTO keys (id, kid, keyid, name) VALUES (1, '0x4e2584fc19840e5f', %d, 'Leia')"%0x4e2584fc19840e5f)
+        self.engine.execute("INSERT INTO releasekeyassociations (left_id, right_id, policy_exception, is_active) VALUES (1, 1, 0, 1)")
+
+        target = sqlalchemy.create_engine("sqlite://")
+        counts = transfer.copy_database(self.engine, target, batch_size=1)
+        self.assertEqual(counts["releases"], 2)
+        self.assertEqual(migrations.current_version(target), migrations.head())
+
+        for table in ("mailinglists", "releases", "keys", "releasekeyassociations"):
+            query = "SELECT * FROM %s ORDER BY 1"%table
+            self.assertEqual(target.execute(query).fetchall(), self.engine.execute(query).fetchall())
+
+        self.assertRaises(ValueError, transfer.copy_database, self.engine, target)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,412 @@
+#!/usr/bin/python
+"""
+Mon runs a mailing list for the rebel alliance, Leia, Luke and Han are on it.
+"""
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+BATZENCADIR = tempfile.mkdtemp()
+shutil.copytree(os.path.join(os.path.dirname(os.path.abspath(__file__)), "batzencadir", "gnupg"),
+                os.path.join(BATZENCADIR, "gnupg"))
+
+import batzenca
+from batzenca import EntryNotFound, Key, Peer, MailingList, Policy, Release, Session, bind
+from batzenca import reports
+from batzenca.database.loading import count_queries, no_lazy_loads
+
+session = Session(BATZENCADIR)
+_previous = []
+
+
+def setUpModule():
+    _previous.append(bind(session))
+
+
+def tearDownModule():
+    bind(_previous.pop())
+
+
+def get_key(keyid, name):
+    try:
+        return Key.from_keyid(keyid)
+    except EntryNotFound:
+        key = Key(keyid)
+        Peer(name, key)
+        session.add(key)
+        session.commit()
+        return key
+
+
+class TestRelease(unittest.TestCase):
+    def setUp(self):
+        self.mon  = get_key("FABA3916FB56A97D", "Mon")
+        self.leia = get_key("4E2584FC19840E5F", "Leia")
+        self.han  = get_key("DB22248C8F4C0C37", "Han")
+        self.luke = get_key("E843C898AB0FA2FD", "Luke")
+
+        policy = Policy("rebels", datetime.date(2013, 11, 17), self.mon, 1024, 720, (session.gnupg.GPGME_PK_RSA,))
+        self.mailinglist = MailingList(self.id(), "rebels@batzen.ca", policy)
+        session.add(self.mailinglist)
+        session.commit()
+
+    def test_keyid(self):
+        self.assertEqual(Key.keyid_to_int("0xE843C898AB0FA2FD"), Key.keyid_to_int(0xe843c898ab0fa2fd))
+        self.assertTrue(self.luke.keyid < 0)
+        self.assertIs(Key.from_keyid(self.luke.fpr), self.luke)
+        self.assertIs(Key.from_keyid(self.luke.fingerprint), self.luke)
+        self.assertIs(Key.from_keyid(0xe843c898ab0fa2fd), self.luke)
+        self.assertRaises(EntryNotFound, Key.from_keyid, "0"*24 + self.luke.kid[2:])
+        self.assertEqual(len(set([self.luke, Key.from_keyid(self.luke.kid)])), 1)
+
+    def test_membership(self):
+        release = Release(self.mailinglist, datetime.date(2014, 1, 1), [self.leia, self.luke], [self.han])
+        session.commit()
+
+        self.assertEqual(set(release.active_keys), set([self.leia, self.luke]))
+        self.assertEqual(release.inactive_keys, [self.han])
+        self.assertIs(release._membership(), release._membership())
+
+        release.delete_key(self.luke)
+        self.assertEqual(release.active_keys, [self.leia])
+
+        release.add_key(self.luke, check=False)
+        self.assertEqual(set(release.active_keys), set([self.leia, self.luke]))
+
+        membership = release._membership()
+        session.commit()
+        self.assertIsNot(release._membership(), membership)
+        self.assertEqual(release.inactive_keys, [self.han])
+
+    def test_diff(self):
+        first = Release(self.mailinglist, datetime.date(2014, 1, 1), [self.leia, self.luke], [])
+        last  = Release(self.mailinglist, datetime.date(2014, 2, 1), [self.leia, self.han], [self.luke])
+        session.commit()
+
+        keys_in, keys_out, peers_joined, peers_changed, peers_left = last.diff()
+        self.assertEqual(keys_in, set([self.han]))
+        self.assertEqual(keys_out, set([self.luke]))
+        self.assertEqual(peers_joined, set([self.han.peer]))
+        self.assertEqual(peers_changed, set())
+        self.assertEqual(peers_left, set([self.luke.peer]))
+
+        self.assertEqual(Release.diff_range(first, last), last.diff(first))
+        self.assertEqual(Release.diff_range(first, first), (set(), set(), set(), set(), set()))
+
+    def test_chain(self):
+        releases = []
+        for month in range(1, 5):
+            releases.append(Release(self.mailinglist, datetime.date(2014, month, 1), [self.leia], []))
+        session.commit()
+
+        self.assertIs(self.mailinglist.current_release, releases[-1])
+        self.assertIsNone(releases[0].prev)
+        self.assertIs(releases[2].prev, releases[1])
+
+        self.assertEqual(list(releases[3].ancestors()), releases[2::-1])
+        self.assertEqual(list(releases[3].ancestors(2)), releases[2:0:-1])
+        self.assertEqual(list(releases[0].ancestors()), [])
+
+        release = self.mailinglist.new_release(date=datetime.date(2014, 5, 1), deactivate_invalid=False)
+        self.assertIs(release.prev, releases[-1])
+        self.assertIs(self.mailinglist.current_release, release)
+
+        # older releases are linked in by date
+        backfill = Release(self.mailinglist, datetime.date(2014, 2, 15), [self.leia], [])
+        self.assertIs(backfill.prev, releases[1])
+        self.assertIs(releases[2].prev, backfill)
+        self.assertIs(self.mailinglist.current_release, release)
+        session.commit()
+
+        # deleting releases repairs the links
+        session.db_session.delete(backfill)
+        session.db_session.delete(releases[2])
+        session.commit()
+        self.assertIs(releases[3].prev, releases[1])
+        session.db_session.delete(release)
+        session.commit()
+        self.assertIs(self.mailinglist.current_release, releases[3])
+        self.assertEqual(list(releases[3].ancestors()), releases[1::-1])
+
+    def test_peers_last_seen(self):
+        Release(self.mailinglist, datetime.date(2014, 1, 1), [self.leia, self.luke], [])
+        Release(self.mailinglist, datetime.date(2014, 2, 1), [self.leia], [])
+        release = Release(self.mailinglist, datetime.date(2014, 3, 1), [self.leia, self.luke, self.han], [])
+        session.commit()
+
+        last_seen = release.peers_last_seen()
+        self.assertEqual(last_seen, {self.leia.peer.id: (datetime.date(2014, 2, 1), True),
+                                     self.luke.peer.id: (datetime.date(2014, 1, 1), False)})
+        self.assertEqual(set(release.peers), set([self.leia.peer, self.luke.peer, self.han.peer]))
+
+    def test_load(self):
+        release = Release(self.mailinglist, datetime.date(2014, 1, 1), [self.leia, self.luke], [self.han])
+        session.commit()
+        session.db_session.expire_all()
+
+        with count_queries(session.db_engine) as statements:
+            release.load("publish")
+        self.assertTrue(len(statements) <= 4)
+
+        with no_lazy_loads(session.db_engine):
+            peers = [assoc.key.peer for assoc in release.key_associations]
+            self.assertEqual(set(peers), set([self.leia.peer, self.luke.peer, self.han.peer]))
+            self.assertEqual(set(release.active_keys), set([self.leia, self.luke]))
+            self.assertEqual(release.policy.ca, self.mon)
+
+        self.assertRaises(ValueError, release.load, "inspect")
+
+        # queries by other threads are not lazy loads of this thread
+        import threading
+        with no_lazy_loads(session.db_engine):
+            thread = threading.Thread(target=lambda: (session.query(Release).count(), session.remove()))
+            thread.start()
+            thread.join()
+
+    def test_reports(self):
+        first  = Release(self.mailinglist, datetime.date(2014, 1, 1), [self.leia, self.luke], [])
+        second = Release(self.mailinglist, datetime.date(2014, 2, 1), [self.leia], [self.luke])
+        session.commit()
+
+        members = list(reports.members(second))
+        self.assertEqual(set((row.kid, row.is_active) for row in members), set([(self.leia.kid, True), (self.luke.kid, False)]))
+        self.assertEqual([row.kid for row in reports.members(second, active=False)], [self.luke.kid])
+        self.assertEqual(members[0].release_id, second.id)
+
+        sizes = list(reports.sizes([self.mailinglist], batch_size=1))
+        self.assertEqual([(row.release_id, row.active, row.inactive) for row in sizes], [(first.id, 2, 0), (second.id, 1, 1)])
+        self.assertEqual([row.id for row in reports.releases([self.mailinglist])], [first.id, second.id])
+        self.assertIn(self.han.kid, [row.kid for row in reports.keys()])
+
+        self.assertIn("  - %s"%self.luke.kid, second.yaml.split("inactive keys:")[1])
+
+    def test_history(self):
+        Release(self.mailinglist, datetime.date(2014, 1, 1), [self.leia, self.luke], [])
+        Release(self.mailinglist, datetime.date(2014, 2, 1), [self.leia, self.han], [self.luke])
+        Release(self.mailinglist, datetime.date(2014, 3, 1), [], [])
+        session.commit()
+
+        rows = list(reports.history([self.mailinglist]))
+        self.assertEqual([tuple(row[3:]) for row in rows], [(2, 0, 2, 0), (2, 1, 1, 1), (0, 0, 0, 2)])
+        self.assertEqual(set(row.mailinglist for row in rows), set([self.mailinglist.name]))
+
+    def test_audit(self):
+        first = Release(self.mailinglist, datetime.date(2014, 1, 1), [self.leia, self.luke], [])
+        second = Release(self.mailinglist, datetime.date(2014, 2, 1), [self.leia, self.han], [self.luke])
+        second.add_exception(self.han)
+        Release(self.mailinglist, datetime.date(2014, 3, 1), [], [])
+        session.commit()
+
+        # Leia's key does not expire, Han's key would violate the policy but has an exception
+        mailinglist_id = self.mailinglist.id
+        with count_queries(session.db_engine) as statements:
+            rows = list(reports.audit([self.mailinglist]))
+        self.assertTrue(len(statements) <= 6)
+        self.assertEqual([row.keys for row in rows], [2, 2, 0])
+        self.assertEqual([row.violations["expiration"] for row in rows], [(self.leia.kid,), (self.leia.kid,), ()])
+        self.assertEqual(rows[1].violations["ca_signature"], ())
+        self.assertEqual(reports.audit([self.mailinglist], ignore_exceptions=True).next().violations["ca_signature"], ())
+        self.assertEqual(list(reports.audit([self.mailinglist], ignore_exceptions=True))[1].violations["ca_signature"], (self.han.kid,))
+
+        tightened = Policy("tightened", datetime.date(2015, 1, 1), self.mon, 4096, 720, (session.gnupg.GPGME_PK_RSA,))
+        rows = list(reports.audit([self.mailinglist], policy=tightened, rules=("length",), signed_by=self.mon, active=None))
+        self.assertEqual(set(rows[0].violations), set(["length", "missing", "signed_by"]))
+        self.assertEqual(rows[0].violations["length"], (self.leia.kid,))
+        self.assertEqual(set(rows[1].violations["signed_by"]), set([self.leia.kid, self.luke.kid]))
+        self.assertEqual(rows[1].keys, 3)
+
+    def test_expiry(self):
+        release = Release(self.mailinglist, datetime.date(2015, 5, 1), [self.leia, self.luke, self.han], [])
+        session.commit()
+        self.assertEqual(self.luke.expiry_date, datetime.date(2015, 5, 11))
+        self.assertIsNone(self.leia.expiry_date)
+
+        def key_expires(keyid):
+            raise AssertionError("GnuPG was queried.")
+        session.gnupg.key_expires = key_expires
+        try:
+            self.assertEqual(release.expiring_keys(days=30), (self.luke,))
+            rows = list(reports.expiring(datetime.date(2015, 1, 1), datetime.date(2016, 1, 1), [self.mailinglist]))
+            self.assertEqual([row.kid for row in rows], [self.luke.kid, self.han.kid])
+            rows = list(reports.expiry_histogram(datetime.date(2015, 5, 4), weeks=2, mailinglists=[self.mailinglist]))
+            self.assertEqual([(row.week, row.keys) for row in rows], [(datetime.date(2015, 5, 4), 0), (datetime.date(2015, 5, 11), 1)])
+            rows = list(reports.expiry_forecast(30, datetime.date(2015, 5, 1), [self.mailinglist]))
+            self.assertEqual(tuple(rows[0][1:]), (3, 0, 1, datetime.date(2015, 5, 11)))
+        finally:
+            del session.gnupg.key_expires
+
+        self.luke.expiry_date = None
+        self.assertEqual(Key.refresh_all(), (self.luke,))
+        self.assertEqual(self.luke.expiry_date, datetime.date(2015, 5, 11))
+        self.han.expiry_date = None
+        self.assertEqual(Key.refresh_all([self.leia]), ())
+        self.assertIsNone(self.han.expiry_date)
+        session.commit()
+
+        # keys added to a release are refreshed
+        release.delete_key(self.han)
+        release.add_key(self.han, check=False)
+        self.assertEqual(self.han.expiry_date, datetime.date(2015, 11, 17))
+        session.commit()
+
+    def test_prepare(self):
+        from batzenca.pgpmime import PGPMIMEPool
+
+        class SMTP(object):
+            def __init__(self):
+                self.sent = []
+
+            def sendmail(self, sender, recipients, msg):
+                self.sent.append((sender, recipients, msg))
+
+        self.mailinglist.new_member_msg = u"Welcome {peer}."
+        self.mailinglist.key_update_msg = u"{keys}"
+        self.mailinglist.key_expiry_warning_msg = u"Your key {keyid} expires on {expiry_date}."
+        release = Release(self.mailinglist, datetime.date(2014, 1, 1), [self.leia, self.luke], [])
+        session.commit()
+
+        smtp = SMTP()
+        with PGPMIMEPool(2) as pool:
+            prepared = release.prepare(check=False, debug=True, pool=pool, key_expiry_warning_days=600)
+            release.send(smtp, prepared=prepared)
+
+        self.assertEqual([recipients for sender, recipients, msg in smtp.sent],
+                         [("mon@batzen.ca", "mon@batzen.ca")]*2 + [("mon@batzen.ca",)]*2)
+        self.assertTrue(all("BEGIN PGP MESSAGE" in msg for sender, recipients, msg in smtp.sent))
+        self.assertEqual(prepared.release_message()["Subject"], "KeyUpdate 20140101 [%s]"%self.mailinglist.name)
+        self.assertFalse(release.published)
+        self.assertRaises(ValueError, Release(self.mailinglist, datetime.date(2014, 2, 1), [], []).send, smtp, prepared=prepared)
+
+    def test_welcome_messages(self):
+        self.mailinglist.new_member_msg = u"Welcome {peer}."
+        self.mailinglist.key_expiry_warning_msg = u"Your key {keyid} expires on {expiry_date}."
+        release = Release(self.mailinglist, datetime.date(2014, 1, 1), [self.leia, self.luke, self.han], [])
+        session.commit()
+
+        messages = release.welcome_messages(jobs=2)
+        self.assertEqual(set(msg["To"] for msg in messages), set(["leia@batzen.ca", "luke@batzen.ca", "han@batzen.ca"]))
+        messages = list(release.key_expiry_messages(days=700, jobs=1))
+        self.assertEqual([msg["To"] for msg in messages], ["luke@batzen.ca", "han@batzen.ca"])
+
+    def test_find_leaks(self):
+        import pickle
+        from batzenca.pgpmime import PlaintextLeak, find_leaks, check_leaks
+
+        keys = [self.leia, self.luke, self.han]
+        self.assertEqual(find_leaks("-----BEGIN PGP MESSAGE-----\nhQEMA0U5g\n", keys), ())
+        text = "key %s\nfingerprint = %s\n"%(self.leia.kid.upper(), self.luke.fingerprint)
+        self.assertEqual(find_leaks(text, keys), tuple(sorted([self.leia.kid, self.luke.kid])))
+        self.assertEqual(find_leaks("0000" + self.han.fpr.lower(), keys), (self.han.kid,))
+
+        with self.assertRaises(PlaintextLeak) as cm:
+            check_leaks(text, [(key.kid, key.fpr) for key in keys])
+        self.assertEqual(pickle.loads(pickle.dumps(cm.exception)).leaks, cm.exception.leaks)
+        check_leaks(text, [self.han])
+
+    def test_find_orphaned_keys(self):
+        from batzenca.util import find_orphaned_keys
+        self.assertEqual(find_orphaned_keys(), tuple())
+
+    def test_inherit(self):
+        first = Release(self.mailinglist, datetime.date(2014, 1, 1), [self.leia, self.han], [self.luke])
+        first.add_exception(self.leia)
+        session.commit()
+
+        # Han's key is not signed by Mon, Luke's key was not active a release ago
+        second = first.inherit(date=datetime.date(2014, 2, 1), delete_old_inactive_keys=1)
+        self.assertIs(second.prev, first)
+        self.assertEqual(second.active_keys, [self.leia])
+        self.assertEqual(second.inactive_keys, [self.han])
+        self.assertTrue(second.has_exception(self.leia))
+        self.assertFalse(second.has_exception(self.han))
+        self.assertEqual(len(second.key_associations), 2)
+        session.commit()
+
+        third = second.inherit(date=datetime.date(2014, 3, 1), deactivate_invalid=False, delete_old_inactive_keys=False)
+        self.assertEqual(set(third.keys), set([self.leia, self.han]))
+        self.assertTrue(third.has_exception(self.leia))
+        self.assertIn(third, self.leia.releases)
+
+    def test_verify(self):
+        import pickle
+        import warnings
+        from batzenca import PolicyViolation
+
+        release = Release(self.mailinglist, datetime.date(2014, 1, 1), [self.leia, self.luke, self.han], [])
+        release.add_exception(self.han)
+        session.commit()
+
+        # Leia's key does not expire, Han's key is DSA and is not signed by Mon
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always", PolicyViolation)
+            report = release.verify()
+        self.assertEqual(len(w), 1)
+        self.assertEqual(len(report), 3*len(self.mailinglist.policy.rules))
+        self.assertFalse(report.passed)
+        self.assertEqual(report.failed_keys(), (self.leia.kid,))
+        self.assertEqual([result.rule for result in report.failures(key=self.leia)], ["expiration"])
+        self.assertEqual(set(result.rule for result in report.filter(key=self.han.keyid, passed=False)),
+                         set(["algorithms", "ca_signature"]))
+        self.assertTrue(all(result.exception for result in report.filter(key=self.han)))
+
+        report = release.verify(ignore_exceptions=True, warn=False)
+        self.assertEqual(set(report.failed_keys()), set([self.leia.kid, self.han.kid]))
+
+        copy = pickle.loads(pickle.dumps(report))
+        self.assertEqual(copy.as_dict(), report.as_dict())
+        self.assertFalse(copy.as_dict()["keys"][self.luke.kid]["length"]["exception"])
+
+        policy = self.mailinglist.policy
+        merged = policy.evaluate([self.leia]).merge(policy.evaluate([self.luke, self.han]))
+        self.assertEqual(merged.results, report.results)
+        self.assertTrue(policy.evaluate([self.luke], rules=("ca_signature", "length")).passed)
+
+    def test_keys_info(self):
+        from batzenca.gnupg import KeyError as GnuPGKeyError
+
+        gnupg = session.gnupg
+        listings = []
+        op_keylist_all = gnupg.ctx.op_keylist_all
+        gnupg.ctx.op_keylist_all = lambda *args: listings.append(args) or op_keylist_all(*args)
+        try:
+            # few keys are fetched one by one
+            gnupg._key_cache = {}
+            self.assertTrue(self.mailinglist.policy.check(self.luke))
+            self.assertEqual(listings, [])
+
+            # many keys are fetched by one listing which caches all keys
+            gnupg._key_cache = {}
+            gnupg.keylist_threshold = 1
+            info = gnupg.keys_info([self.leia.kid, self.luke.kid])
+            self.assertEqual(info[self.luke.kid].fpr, self.luke.fpr)
+            self.assertEqual(len(listings), 1)
+            gnupg.keys_info([self.han.kid, self.mon.kid])
+            self.assertEqual(len(listings), 1)
+
+            self.assertRaises(GnuPGKeyError, gnupg.keys_info, [self.leia.kid, "0x" + "0"*16])
+            self.assertEqual(gnupg.keys_info(["0x" + "0"*16, self.leia.kid], ignore_missing=True).keys(), [self.leia.kid])
+        finally:
+            del gnupg.ctx.op_keylist_all
+            del gnupg.keylist_threshold
+
+    def test_verify_all(self):
+        from batzenca.util import verify_all
+
+        other = MailingList(self.id() + "-other", "other@batzen.ca", self.mailinglist.policy)
+        first = Release(self.mailinglist, datetime.date(2014, 1, 1), [self.leia, self.luke, self.han], [])
+        second = Release(other, datetime.date(2014, 1, 1), [self.leia], [self.han])
+        first.add_exception(self.han)
+        session.add(other)
+        session.commit()
+
+        reports = verify_all([self.mailinglist, other], jobs=2, shard_size=2, warn=False)
+        self.assertEqual(list(reports), [self.mailinglist, other])
+        self.assertEqual(reports[self.mailinglist].results, first.verify(warn=False).results)
+        self.assertEqual(reports[other].results, second.verify(warn=False).results)
+        self.assertEqual(verify_all([other], jobs=1, warn=False)[other].results, reports[other].results)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+"""
+Several sessions live in one process, threads get their own database sessions, readers do not wait
+for writers and read-only sessions do not write.
+"""
+
+import os
+import shutil
+import sqlalchemy.exc
+import tempfile
+import threading
+import unittest
+
+import batzenca
+from batzenca import EntryNotFound, ReadOnlyError, Key, Peer, Session, bind
+from batzenca.session import current
+
+
+def worker_session():
+    return current().path, current().readonly, len(current().gnupg._key_cache) > 0
+
+
+def new_session():
+    path = tempfile.mkdtemp()
+    shutil.copytree(os.path.join(os.path.dirname(os.path.abspath(__file__)), "batzencadir", "gnupg"),
+                    os.path.join(path, "gnupg"))
+    return Session(path)
+
+session = new_session()
+_previous = []
+
+
+def setUpModule():
+    _previous.append(bind(session))
+
+
+def tearDownModule():
+    bind(_previous.pop())
+
+
+class TestSession(unittest.TestCase):
+    def in_thread(self, f):
+        result = []
+
+        def run():
+            try:
+                result.append(f())
+            finally:
+                session.remove()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        return result[0]
+
+    def test_pragmas(self):
+        self.assertEqual(session.db_session.execute("PRAGMA journal_mode").scalar(), "wal")
+        self.assertEqual(session.db_session.execute("PRAGMA busy_timeout").scalar(), 5000)
+
+    def test_threads(self):
+        main = session.db_session()
+        self.assertIsNot(self.in_thread(lambda: session.db_session()), main)
+        self.assertIs(session.db_session(), main)
+
+    def test_reader_does_not_block(self):
+        count = session.query(Peer).count()
+
+        session.add(Peer(u"Chewbacca", []))
+        session.db_session.flush()
+
+        # the writer holds an open transaction, a reader sees the last committed state
+        self.assertEqual(self.in_thread(lambda: session.query(Peer).count()), count)
+        session.db_session.rollback()
+
+    def test_several_sessions(self):
+        first, second = new_session(), new_session()
+
+        with first:
+            self.assertIs(current(), first)
+            first.add(Key("E843C898AB0FA2FD"))
+            first.commit()
+
+            with second:
+                self.assertIs(current(), second)
+                self.assertRaises(EntryNotFound, Key.from_keyid, "E843C898AB0FA2FD")
+                # other threads are not affected
+                self.assertIs(self.in_thread(current), session)
+
+            self.assertEqual(Key.from_keyid("E843C898AB0FA2FD").email, "luke@batzen.ca")
+
+        self.assertIs(current(), session)
+        self.assertIsNot(first.gnupg._key_cache, second.gnupg._key_cache)
+
+    def test_readonly(self):
+        session.add(Key("4E2584FC19840E5F"))
+        session.commit(snapshot=True)
+
+        readonly = Session(session.path, readonly=True)
+        with readonly:
+            key = Key.from_keyid("4E2584FC19840E5F")
+            self.assertEqual(key.email, "leia@batzen.ca")
+
+            key.name = u"Leia Skywalker"
+            self.assertRaises(ReadOnlyError, readonly.commit)
+            readonly.db_session.rollback()
+            self.assertRaises(ReadOnlyError, readonly.snapshot)
+            self.assertRaises(ReadOnlyError, readonly.gnupg.keys_import, "")
+            # the database itself refuses writes which bypass the ORM
+            self.assertRaises(sqlalchemy.exc.OperationalError, readonly.db_session.execute, "DELETE FROM keys")
+
+        with self.assertRaises(IOError):
+            Session(tempfile.mkdtemp(), readonly=True).gnupg
+        self.assertEqual(Key.from_keyid("4E2584FC19840E5F").name, u"Leia Organa")
+
+    def test_workers(self):
+        import multiprocessing
+        from batzenca.util import _verify_init
+        from batzenca.pgpmime import _pool_init
+
+        other = new_session()
+        with other:
+            # verify_all workers list the keyring once up front
+            for initializer, initargs, cached in ((_verify_init, (session.path, session.db_url), True),
+                                                  (_pool_init, (session.path,), False)):
+                pool = multiprocessing.Pool(1, initializer=initializer, initargs=initargs)
+                try:
+                    self.assertEqual(pool.apply(worker_session), (session.path, True, cached))
+                finally:
+                    pool.close()
+                    pool.join()
+
+    def test_bulk(self):
+        from batzenca.database.loading import count_queries
+
+        with session.bulk(batch_size=2):
+            self.assertFalse(session.db_session.autoflush)
+            peers = [Peer(u"Wedge %d"%i, []) for i in range(3)]
+            session.add_all(peers[:2])
+            self.assertIsNotNone(peers[1].id)
+            session.add(peers[2])
+            self.assertIsNone(peers[2].id)
+        self.assertIsNotNone(peers[2].id)
+        self.assertTrue(session.db_session.autoflush)
+
+        with session.bulk():
+            session.commit()
+            with count_queries(session.db_engine) as statements:
+                [peer.name for peer in peers]
+            self.assertEqual(statements, [])
+
+        session.commit()
+        with count_queries(session.db_engine) as statements:
+            peers[0].name
+        self.assertEqual(len(statements), 1)
+
+    def test_upgrade(self):
+        import sqlite3
+        from test_migrations import LEGACY_SCHEMA
+        from batzenca.database.migrations import current_version, head
+
+        legacy = new_session()
+        connection = sqlite3.connect(os.path.join(legacy.path, "batzenca.db"))
+        for statement in LEGACY_SCHEMA:
+            connection.execute(statement)
+        connection.commit()
+        connection.close()
+
+        # the engine is only published once the schema is upgraded
+        published = []
+        legacy._snapshot = lambda db_engine, msg: published.append((db_engine.url.database, legacy._db_engine))
+        self.assertEqual(current_version(legacy.db_engine), head())
+        self.assertEqual(published, [(os.path.join(legacy.path, "batzenca.db"), None)])
+
+    def test_database_url(self):
+        other = new_session()
+        filename = os.path.join(tempfile.mkdtemp(), "other.db")
+        with open(os.path.join(other.path, "batzenca.cfg"), "w") as fh:
+            fh.write("[database]\nurl: sqlite:///%s\nisolation_level: SERIALIZABLE\n"%filename)
+
+        self.assertEqual(other.db_url, "sqlite:///%s"%filename)
+        with other:
+            other.add(Peer(u"Lando", []))
+            other.commit()
+        self.assertTrue(os.path.exists(filename))
+        self.assertFalse(os.path.exists(os.path.join(other.path, "batzenca.db")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/python
+"""
+Importing batzenca is cheap: nothing is set up before it is used.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPT = """
+import gc, sys, time
+start = time.time()
+import sqlalchemy.orm, sqlalchemy.ext.declarative
+print time.time() - start
+start = time.time()
+import batzenca
+print time.time() - start
+print " ".join(sorted(name for name in HEAVY if name in sys.modules))
+from sqlalchemy.engine import Engine
+print sum(1 for obj in gc.get_objects() if isinstance(obj, Engine))
+"""
+
+# modules which are only imported once a backend is used
+HEAVY = ("pyme", "git", "sqlite3", "_sqlite3", "multiprocessing", "smtplib")
+
+
+class TestStartup(unittest.TestCase):
+    def test_import(self):
+        path = os.path.join(tempfile.mkdtemp(), "batzenca")
+
+        env = dict(os.environ)
+        env["BATZENCADIR"] = path
+        script = "HEAVY = %r\n"%(HEAVY,) + SCRIPT
+        out = subprocess.check_output([sys.executable, "-c", script], env=env).splitlines()
+
+        # importing our own modules costs less than importing SQLAlchemy which they build on
+        baseline, elapsed = float(out[0]), float(out[1])
+        self.assertLess(elapsed, baseline)
+        self.assertEqual(out[2].strip(), "")
+        self.assertEqual(int(out[3]), 0)
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()